@@ -1,5 +1,19 @@
 from django.contrib import admin
-from main.models import Subject, Card
+from main.models import Subject, Card, CardCompletion
 
+class CardCompletionAdmin(admin.ModelAdmin):
+    """The completion log is append-only, so the admin can only read it."""
+    list_display = ("title", "user", "points", "cleared_at")
+    
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+        
+    def has_add_permission(self, request):
+        return False
+        
+    def has_delete_permission(self, request, obj=None):
+        return False
+        
 admin.site.register(Subject)
-admin.site.register(Card)
\ No newline at end of file
+admin.site.register(Card)
+admin.site.register(CardCompletion, CardCompletionAdmin)
@@ -0,0 +1,69 @@
+"""Upcoming cards over a date window, a page at a time.
+
+Pages are ordered by (date, id) and continue from a cursor holding the last
+(date, id) returned, so each page is a range scan of the (user, date, id)
+index rather than an OFFSET that rereads every earlier card."""
+import base64
+from datetime import datetime
+
+from django.db.models import Count, Sum
+
+from main.encoding import CARD_FIELDS
+from main.models import Card
+
+class BadCursor(ValueError):
+    pass
+    
+def encode_cursor(card_date, card_id):
+    return base64.urlsafe_b64encode("%s.%d" % (card_date.isoformat(), card_id)).rstrip("=")
+    
+def decode_cursor(cursor):
+    """Returns the (date, id) a cursor continues after."""
+    try:
+        text = base64.urlsafe_b64decode(str(cursor) + "=" * (-len(cursor) % 4))
+        card_date, card_id = text.split(".")
+        return datetime.strptime(card_date, "%Y-%m-%d").date(), int(card_id)
+    except (TypeError, ValueError, UnicodeError):
+        raise BadCursor(cursor)
+        
+def page(user, start, end=None, cursor=None, size=50):
+    """Returns the page of the user's cards due from start to end (inclusive;
+    open-ended if end is None) that follows cursor.
+    
+    Cards are grouped by day, and each day carries the number and points of
+    all its cards in the window, not only those on this page."""
+    cards = Card.objects.filter(user=user, date__gte=start)
+    if end is not None:
+        cards = cards.filter(date__lte=end)
+    window = cards
+    if cursor is not None:
+        after_date, after_id = decode_cursor(cursor)
+        cards = cards.filter(date__gte=after_date).exclude(date=after_date, pk__lte=after_id)
+    rows = list(cards.order_by("date", "pk")[:size + 1]
+                     .values_list("pk", "title", "subject_id", "colour", "points", "date"))
+    more = len(rows) > size
+    rows = rows[:size]
+    
+    colours = dict(Card._meta.get_field("colour").flatchoices)
+    days = []
+    for pk, title, subject_id, colour, points, card_date in rows:
+        if not days or days[-1]["date"] != card_date:
+            days.append({ "date": card_date, "cards": [] })
+        days[-1]["cards"].append([pk, title, subject_id, colours.get(colour, colour), points])
+        
+    if days:
+        totals = dict((card_date, (count, points)) for card_date, count, points in
+                      window.filter(date__gte=days[0]["date"], date__lte=days[-1]["date"])
+                            .values_list("date").annotate(Count("pk"), Sum("points")).order_by("date"))
+        for day in days:
+            # A concurrent clear may have taken the day's last card since the page was read
+            day["count"], day["points"] = totals.get(day["date"], (0, 0))
+            day["date"] = day["date"].isoformat()
+            
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat() if end else None,
+        "fields": CARD_FIELDS,
+        "days": days,
+        "next": encode_cursor(rows[-1][5], rows[-1][0]) if more else None,
+    }
@@ -1,7 +1,12 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class MainConfig(AppConfig):
     name = 'main'
+
+    def ready(self):
+        from main.db import configure_sqlite
+        connection_created.connect(configure_sqlite, dispatch_uid="main.configure_sqlite")
@@ -0,0 +1,87 @@
+"""Static files with content-hashed names, precompressed copies and
+far-future caching.
+
+CompressedManifestStaticFilesStorage is the STATICFILES_STORAGE outside
+DEBUG: collectstatic gives every file a name containing a hash of its
+contents, which {% static %} links to, and writes .gz (and .br, when the
+brotli package is installed) copies of the text files beside them. serve
+sends the smallest copy the client accepts; hashed names never change
+contents, so they are cached for a year and marked immutable."""
+import gzip, mimetypes, os, re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+
+# Files worth compressing; fonts like woff2 are compressed already
+COMPRESSIBLE = (".css", ".js", ".map", ".svg", ".eot", ".ttf", ".txt", ".html", ".json")
+# name.0123456789ab.ext, as ManifestStaticFilesStorage names them
+HASHED_NAME = re.compile(r"\.[0-9a-f]{12}\.[^./]+$")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=0, must-revalidate"
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super(CompressedManifestStaticFilesStorage, self) \
+                                                .post_process(paths, dry_run, **options):
+            if not dry_run and hashed_name and not isinstance(processed, Exception):
+                self.compress(hashed_name)
+            yield name, hashed_name, processed
+            
+    def compress(self, name):
+        """Writes name.gz and name.br beside the file, keeping only those that
+        are smaller than it."""
+        if not name.endswith(COMPRESSIBLE):
+            return
+        path = self.path(name)
+        with open(path, "rb") as f:
+            content = f.read()
+        with open(path + ".gz", "wb") as f:
+            # A fixed mtime keeps the output identical between runs
+            with gzip.GzipFile(filename="", mode="wb", fileobj=f, compresslevel=9, mtime=0) as gz:
+                gz.write(content)
+        if os.path.getsize(path + ".gz") >= len(content):
+            os.remove(path + ".gz")
+        if brotli is not None:
+            compressed = brotli.compress(content)
+            if len(compressed) < len(content):
+                with open(path + ".br", "wb") as f:
+                    f.write(compressed)
+                    
+def accepted_encodings(request):
+    return set(part.split(";")[0].strip() for part in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","))
+    
+def serve(request, path):
+    """Serves a collected static file from STATIC_ROOT, precompressed if the
+    client accepts it."""
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except ValueError:
+        raise Http404(path)
+    if not os.path.isfile(full_path):
+        raise Http404(path)
+        
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    encoding = None
+    accepted = accepted_encodings(request)
+    for name, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if name in accepted and os.path.isfile(full_path + suffix):
+            encoding = name
+            full_path += suffix
+            break
+            
+    response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    response["Content-Length"] = os.path.getsize(full_path)
+    if encoding:
+        response["Content-Encoding"] = encoding
+    response["Cache-Control"] = IMMUTABLE if HASHED_NAME.search(path) else REVALIDATE
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
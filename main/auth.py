@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from main import sync
+from main.caching import remember_subjects_version
+from main.models import StudyUser
+
+class StudyUserBackend(ModelBackend):
+    """The stock backend, but a request's user is loaded together with their
+    StudyUser, so the deck and subject versions (see main.caching) cost no
+    query of their own."""
+    def get_user(self, user_id):
+        user = get_user_model()._default_manager.select_related("studyuser").filter(pk=user_id).first()
+        if user is not None:
+            try:
+                sync.remember_version(user, user.studyuser.version)
+                remember_subjects_version(user, user.studyuser.subjects_version)
+            except StudyUser.DoesNotExist:
+                pass
+        return user
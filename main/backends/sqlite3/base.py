@@ -0,0 +1,47 @@
+"""The stock SQLite backend, with each statement timed for main.metrics and
+transactions that take the write lock when they begin."""
+import time
+
+from django.db.backends.sqlite3 import base
+from django.db.backends.utils import CursorWrapper, CursorDebugWrapper
+
+from main import metrics
+
+class TimedCursorMixin(object):
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return super(TimedCursorMixin, self).execute(sql, params)
+        finally:
+            metrics.record_query(time.time() - start)
+            
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return super(TimedCursorMixin, self).executemany(sql, param_list)
+        finally:
+            metrics.record_query(time.time() - start)
+            
+class TimedCursorWrapper(TimedCursorMixin, CursorWrapper):
+    pass
+    
+class TimedCursorDebugWrapper(TimedCursorMixin, CursorDebugWrapper):
+    pass
+    
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        """Starts atomic blocks with BEGIN IMMEDIATE rather than BEGIN.
+        
+        A deferred transaction that reads and then writes has to upgrade its
+        lock, and SQLite fails that upgrade at once with "database is locked"
+        when another connection is writing, without waiting out busy_timeout.
+        Taking the write lock up front makes concurrent writers queue instead;
+        readers are not blocked under WAL. The wait is the request's "lock" time."""
+        with metrics.timer("lock"):
+            self.cursor().execute("BEGIN IMMEDIATE")
+        
+    def make_cursor(self, cursor):
+        return TimedCursorWrapper(cursor, self)
+        
+    def make_debug_cursor(self, cursor):
+        return TimedCursorDebugWrapper(cursor, self)
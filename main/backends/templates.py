@@ -0,0 +1,21 @@
+"""The Django template backend, with rendering timed for main.metrics."""
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as backend
+from django.template.engine import _dirs_undefined
+
+from main import metrics
+
+class Template(backend.Template):
+    def render(self, context=None, request=None):
+        with metrics.timer("template"):
+            return super(Template, self).render(context, request)
+            
+class DjangoTemplates(backend.DjangoTemplates):
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+        
+    def get_template(self, template_name, dirs=_dirs_undefined):
+        try:
+            return Template(self.engine.get_template(template_name, dirs), self)
+        except TemplateDoesNotExist as exc:
+            backend.reraise(exc, self)
@@ -0,0 +1,68 @@
+import hashlib
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from main import events, sync
+from main.metrics import CACHE_STATS as STATS
+from main.models import StudyUser
+
+def deck_version(user):
+    """The current version of the user's deck.
+    
+    This is StudyUser.version, which every change raises in its own
+    transaction (see main.sync). Because it lives in the database, each
+    process sees a change as soon as it commits, and a cache entry keyed on an
+    old version is simply never asked for again."""
+    return sync.current_version(user)
+    
+def invalidate_deck(user):
+    """Called by every change to the user's deck, which also raises the
+    version; open event streams are told once the transaction commits."""
+    transaction.on_commit(lambda: events.publish(user.pk))
+    
+def subjects_version(user):
+    """The version of the user's subject list, which keys its cached fragment.
+    
+    Only changes to the subject list raise it, so clearing cards leaves the
+    fragment cached. Like the deck version it is read once per request, and
+    main.auth loads it along with the user."""
+    version = getattr(user, "_subjects_version", None)
+    if version is None:
+        version = StudyUser.objects.filter(user=user).values_list("subjects_version", flat=True).first() or 0
+        remember_subjects_version(user, version)
+    return version
+    
+def remember_subjects_version(user, version):
+    user._subjects_version = version
+    
+def invalidate_subjects(user):
+    """Raises the subject list's version, so the cached fragment is rendered again."""
+    StudyUser.objects.filter(user=user).update(subjects_version=F("subjects_version") + 1)
+    user._subjects_version = None
+    
+def deck_etag(user):
+    """A strong validator for the user's next-cards response.
+    
+    Points and multiplier only change along with the version, so the version
+    and date cover them without a query of their own."""
+    tag = "%d:%d:%s" % (user.pk, deck_version(user), datetime.now().date().isoformat())
+    return hashlib.sha1(tag.encode("ascii")).hexdigest()
+
+def next_cards_key(user):
+    # The payload depends on today's date, so a rollover starts a new entry
+    return "next-cards:%d:%d:%s" % (user.pk, deck_version(user), datetime.now().date().isoformat())
+
+def get_next_cards_payload(user, build):
+    """Returns the user's next-cards payload, calling build(user) on a miss."""
+    key = next_cards_key(user)
+    payload = cache.get(key)
+    if payload is not None:
+        STATS["hits"] += 1
+        return payload, True
+    STATS["misses"] += 1
+    payload = build(user)
+    cache.set(key, payload)
+    return payload, False
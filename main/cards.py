@@ -0,0 +1,84 @@
+from django.db import transaction
+from django.utils import timezone
+
+from main import stats, sync
+from main.caching import invalidate_deck
+from main.models import Subject, Card, CardCompletion, StudyUser
+from main.schedule import Schedule, card_key
+
+def build_cards(user, subjects, commence, midsem_break):
+    """Lays out every card for the semester in memory without saving them."""
+    return [Card(title=planned.title,
+                 subject=planned.subject,
+                 points=planned.points,
+                 date=planned.date,
+                 user=user,
+                 colour=planned.subject.colour)
+            for planned in Schedule(commence, midsem_break).cards(subjects)]
+
+def delete_all_cards(user):
+    # Card has no dependents, so this is a single DELETE statement
+    Card.objects.filter(user=user).delete()
+    
+def replace_cards(user, cards, commence, midsem_break):
+    """Swaps the user's whole deck for the given unsaved cards in one
+    transaction, and remembers the semester they were built for."""
+    with transaction.atomic():
+        delete_all_cards(user)
+        version = sync.reset(user, commence=commence, midsem_break=midsem_break, built_at=timezone.now())
+        for card in cards:
+            card.version = version
+        Card.objects.bulk_create(cards)
+        stats.replace_deck(user, cards)
+        invalidate_deck(user)
+        
+def create_all_cards(user, commence, midsem_break):
+    """Regenerates the user's whole deck in one transaction.
+    
+    The number of statements does not depend on the number of subjects;
+    returns the number of cards created."""
+    cards = build_cards(user, Subject.objects.filter(user=user), commence, midsem_break)
+    replace_cards(user, cards, commence, midsem_break)
+    return len(cards)
+    
+def sync_subject_cards(subject, commence, midsem_break):
+    """Brings one subject's cards in line with the semester plan, leaving the
+    rest of the deck alone.
+    
+    Only the difference is written: planned cards that are missing are
+    inserted and stored cards that are no longer planned are deleted. Cards
+    in the completion log count as present, so cleared cards stay cleared.
+    Returns (inserted, deleted)."""
+    planned = dict((card_key(subject.pk, card.title, card.points, card.date), card)
+                   for card in build_cards(subject.user, [subject], commence, midsem_break))
+    stored = dict((card_key(subject.pk, title, points, date), (pk, date))
+                  for pk, title, points, date in Card.objects.filter(subject=subject)
+                                                     .values_list("pk", "title", "points", "date"))
+    completed = set(card_key(subject.pk, title, points, date)
+                    for title, points, date in CardCompletion.objects.filter(subject_id=subject.pk)
+                                                                    .values_list("title", "card_points", "date"))
+    missing = [card for key, card in planned.items() if key not in stored and key not in completed]
+    extra = [row for key, row in stored.items() if key not in planned]
+    if not missing and not extra:
+        return 0, 0
+    with transaction.atomic():
+        version = sync.next_version(subject.user)
+        if extra:
+            Card.objects.filter(pk__in=[pk for pk, date in extra]).delete()
+            sync.record_deleted(subject.user, [pk for pk, date in extra], version)
+            stats.remove_cards(subject.user, [(subject.pk, date) for pk, date in extra])
+        for card in missing:
+            card.version = version
+        Card.objects.bulk_create(missing)
+        stats.add_cards(subject.user, missing)
+        invalidate_deck(subject.user)
+    return len(missing), len(extra)
+    
+def add_subject_cards(subject):
+    """Adds a new subject's cards to a deck that has already been built,
+    leaving the rest of the deck untouched. Returns the number of cards added."""
+    semester = StudyUser.objects.filter(user=subject.user_id) \
+                                .values_list("commence", "midsem_break").first()
+    if semester is None or None in semester:
+        return 0
+    return sync_subject_cards(subject, *semester)[0]
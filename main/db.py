@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+
+# Applied in order: busy_timeout first so that switching to WAL can wait for locks.
+# WAL lets reads carry on during writes; busy_timeout makes writers wait for
+# each other, which relies on the backend beginning them with BEGIN IMMEDIATE.
+DEFAULT_SQLITE_PRAGMAS = (
+    ("busy_timeout", 5000),
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -8000),
+    ("mmap_size", 64 * 1024 * 1024),
+)
+
+def sqlite_pragmas():
+    return getattr(settings, "SQLITE_PRAGMAS", DEFAULT_SQLITE_PRAGMAS)
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas:
+        cursor.execute("PRAGMA %s = %s" % (name, value))
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Tunes each new SQLite connection; hooked up to connection_created."""
+    if connection.vendor != "sqlite":
+        return
+    cursor = connection.cursor()
+    try:
+        apply_pragmas(cursor, sqlite_pragmas())
+    finally:
+        cursor.close()
+
+def supports_upsert(connection):
+    """Whether the database takes INSERT ... ON CONFLICT DO UPDATE."""
+    if connection.vendor == "postgresql":
+        return connection.pg_version >= 90500
+    if connection.vendor == "sqlite":
+        from django.db.backends.sqlite3.base import Database
+        return Database.sqlite_version_info >= (3, 24, 0)
+    return False
+    
+def add_counts(model, keys, rows):
+    """Adds each row's counts to the model's row with the same keys, creating
+    rows that do not exist yet.
+    
+    keys names the fields of a unique constraint, and rows is a list of
+    dicts holding those fields and the counts to add. Where the database has
+    an upsert this is one statement per batch of rows, whether or not the
+    rows exist; elsewhere it is one F() update per row and an insert."""
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    counts = sorted(set(name for row in rows for name in row) - set(keys))
+    if not supports_upsert(connection):
+        missing = []
+        for row in rows:
+            matching = model._default_manager.filter(**dict((name, row[name]) for name in keys))
+            if not matching.update(**dict((name, F(name) + row.get(name, 0)) for name in counts)):
+                missing.append(row)
+        try:
+            with transaction.atomic(using=connection.alias):
+                model._default_manager.bulk_create([model(**row) for row in missing])
+        except IntegrityError:
+            # Some rows were created concurrently; they exist now, so add again
+            add_counts(model, keys, missing)
+        return
+        
+    # Every column is inserted, with its default where the rows leave it out
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    placeholders = "(%s)" % ", ".join(["%s"] * len(fields))
+    sql = "INSERT INTO %s (%s) VALUES %%s ON CONFLICT (%s) DO UPDATE SET %s" % (
+        table,
+        ", ".join(quote(field.column) for field in fields),
+        ", ".join(quote(model._meta.get_field(name).column) for name in keys),
+        ", ".join("%s = %s.%s + excluded.%s" % (quote(column), table, quote(column), quote(column))
+                  for column in [model._meta.get_field(name).column for name in counts]))
+    # SQLite before 3.32 allows at most 999 parameters in a statement
+    batch = max(1, 999 // len(fields))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch):
+            chunk = rows[start:start + batch]
+            params = []
+            for row in chunk:
+                for field in fields:
+                    value = row[field.name] if field.name in row else field.get_default()
+                    params.append(field.get_db_prep_save(getattr(value, "pk", value), connection))
+            cursor.execute(sql % ", ".join([placeholders] * len(chunk)), params)
@@ -0,0 +1,122 @@
+"""Server-sent events telling a user's open pages that their deck changed.
+
+invalidate_deck publishes the user's id once the change commits. The hub
+keeps the subscriptions of each user, so a publish only wakes that user's
+streams, and a stream that is woken several times before it runs sends one
+event. Idle streams hold no database connection and sleep on their own
+condition until a change or the next heartbeat.
+
+The hub is per process: changes made in another process (a separate
+`run_card_jobs`, or another web worker) reach that process's streams only.
+Each open stream occupies a server thread, so streams end after
+STREAM_SECONDS and the browser reconnects, passing the last event id.
+
+Because of both, streams are off unless the EVENT_STREAMS setting is on;
+pages then poll rest/cards/, which is a 304 until the deck changes."""
+import threading, time
+
+from django.conf import settings
+from django.db import connection
+
+HEARTBEAT_SECONDS = 15
+STREAM_SECONDS = 60
+# How long the browser waits before reconnecting, in milliseconds
+RETRY_MS = 2000
+
+class Subscription(object):
+    def __init__(self, hub, user_id):
+        self.hub = hub
+        self.user_id = user_id
+        self.changes = 0
+        self.condition = threading.Condition()
+        
+    def notify(self):
+        with self.condition:
+            self.changes += 1
+            self.condition.notify()
+            
+    def wait(self, seen, timeout):
+        """Waits up to timeout seconds for a change after the first `seen`;
+        returns the number of changes so far."""
+        with self.condition:
+            if self.changes == seen:
+                self.condition.wait(timeout)
+            return self.changes
+            
+    def close(self):
+        self.hub.unsubscribe(self)
+        
+class Hub(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+        
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id)
+        with self.lock:
+            self.subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+        
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.user_id, None)
+                
+    def publish(self, user_id):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.notify()
+            
+    def count(self):
+        with self.lock:
+            return sum(len(subscriptions) for subscriptions in self.subscriptions.values())
+            
+hub = Hub()
+
+def enabled():
+    return getattr(settings, "EVENT_STREAMS", False)
+    
+def publish(user_id):
+    hub.publish(user_id)
+    
+def format_event(event, data, event_id=None):
+    lines = ["event: " + event]
+    if event_id is not None:
+        lines.append("id: " + event_id)
+    lines.extend("data: " + line for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+    
+def stream(hub, user_id, render, last_event_id=None, clock=time.time):
+    """Yields server-sent events for the user's changes on the hub.
+    
+    render() returns the (id, data) of the current state; it is sent when
+    the stream opens, unless the browser already has that id, and after
+    each change. The subscription starts with the first event and ends when
+    the generator is closed, so a response closed before it was iterated
+    leaves nothing subscribed."""
+    subscription = hub.subscribe(user_id)
+    try:
+        yield "retry: %d\n\n" % RETRY_MS
+        end = clock() + STREAM_SECONDS
+        seen = subscription.changes
+        event_id, data = render()
+        if event_id != last_event_id:
+            yield format_event("deck", data, event_id)
+        while clock() < end:
+            # Do not hold a database connection while idle
+            if not connection.in_atomic_block:
+                connection.close()
+            changes = subscription.wait(seen, min(HEARTBEAT_SECONDS, max(0, end - clock())))
+            if changes == seen:
+                yield ": heartbeat\n\n"
+                continue
+            seen = changes
+            event_id, data = render()
+            if event_id != last_event_id:
+                last_event_id = event_id
+                yield format_event("deck", data, event_id)
+    finally:
+        subscription.close()
@@ -0,0 +1,134 @@
+"""A database-backed queue for create_cards.
+
+enqueue_card_job records the request in a CardJob row, keyed per user, and
+returns at once. Jobs are run by a worker thread in the web process
+(CARD_JOBS_WORKER = "thread") or by `manage.py run_card_jobs`; several
+workers can share the table since claiming a job is a conditional update.
+
+A running job touches its updated time at least every PROGRESS_SECONDS;
+one left untouched for STALE_SECONDS belonged to a worker that died, and
+is claimed again under a new run."""
+import threading, traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from main.cards import build_cards, replace_cards
+from main.models import Subject, CardJob
+
+POLL_SECONDS = 5
+PROGRESS_SECONDS = 30
+STALE_SECONDS = 10 * PROGRESS_SECONDS
+
+def card_job_key(user):
+    return "create-cards:%d" % user.pk
+
+def enqueue_card_job(user, commence, midsem_break):
+    """Queues a regeneration of the user's deck, reusing the user's job.
+    
+    Asking again for the dates already queued or running is a no-op; other
+    dates requeue the job, and a run still going for the old dates is dropped."""
+    with transaction.atomic():
+        job, created = CardJob.objects.get_or_create(key=card_job_key(user),
+                                                     defaults={ "user": user,
+                                                                "commence": commence,
+                                                                "midsem_break": midsem_break,
+                                                                "updated": timezone.now() })
+        pending = job.status in (CardJob.QUEUED, CardJob.RUNNING)
+        if not created and not (pending and job.commence == commence and job.midsem_break == midsem_break):
+            CardJob.objects.filter(pk=job.pk).update(commence=commence,
+                                                     midsem_break=midsem_break,
+                                                     status=CardJob.QUEUED,
+                                                     run=F("run") + 1,
+                                                     progress=0,
+                                                     cards=0,
+                                                     error="",
+                                                     updated=timezone.now())
+            job.refresh_from_db()
+    transaction.on_commit(wake_worker)
+    return job
+    
+def claim_next_job():
+    """Marks the oldest queued or stale job as running and returns it, or None.
+    
+    Reclaiming a stale job bumps its run, so the worker that lost it can no
+    longer write to it should it wake up again."""
+    stale = timezone.now() - timedelta(seconds=STALE_SECONDS)
+    pending = CardJob.objects.filter(Q(status=CardJob.QUEUED) | Q(status=CardJob.RUNNING, updated__lt=stale))
+    for job in pending.select_related("user").order_by("updated")[:5]:
+        run = job.run + 1 if job.status == CardJob.RUNNING else job.run
+        claimed = CardJob.objects.filter(pk=job.pk, status=job.status, run=job.run, updated=job.updated) \
+                                 .update(status=CardJob.RUNNING, run=run, updated=timezone.now())
+        if claimed:
+            job.status = CardJob.RUNNING
+            job.run = run
+            return job
+    return None
+    
+def update_job(job, **fields):
+    """Updates the job only if it has not been requeued since it was claimed."""
+    return CardJob.objects.filter(pk=job.pk, run=job.run, status=CardJob.RUNNING) \
+                          .update(updated=timezone.now(), **fields)
+    
+def run_job(job):
+    try:
+        subjects = list(Subject.objects.filter(user=job.user_id))
+        cards = []
+        reported = timezone.now()
+        for i, subject in enumerate(subjects):
+            cards.extend(build_cards(job.user, [subject], job.commence, job.midsem_break))
+            # Progress doubles as the heartbeat, so it is written only now and then
+            if timezone.now() - reported >= timedelta(seconds=PROGRESS_SECONDS):
+                # Building is most of the work; the insert is the last tenth
+                update_job(job, progress=90 * (i + 1) // len(subjects))
+                reported = timezone.now()
+        with transaction.atomic():
+            # Marking the job done first takes the write lock and checks the
+            # run, so a run that was requeued meanwhile leaves the deck alone
+            if update_job(job, status=CardJob.DONE, progress=100, cards=len(cards)):
+                replace_cards(job.user, cards, job.commence, job.midsem_break)
+    except Exception:
+        update_job(job, status=CardJob.FAILED, error=traceback.format_exc())
+        
+def run_pending_jobs():
+    """Runs queued jobs until there are none left; returns how many ran."""
+    count = 0
+    job = claim_next_job()
+    while job is not None:
+        run_job(job)
+        count += 1
+        job = claim_next_job()
+    return count
+    
+class Worker(object):
+    def __init__(self):
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="card-jobs")
+        self.thread.daemon = True
+        self.thread.start()
+        
+    def run(self):
+        while True:
+            try:
+                run_pending_jobs()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                connection.close()
+            self.wake.wait(POLL_SECONDS)
+            self.wake.clear()
+            
+_worker = None
+_worker_lock = threading.Lock()
+
+def wake_worker():
+    global _worker
+    if getattr(settings, "CARD_JOBS_WORKER", "thread") != "thread":
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = Worker()
+    _worker.wake.set()
@@ -0,0 +1,87 @@
+"""Rankings by points, overall and per week.
+
+Users are ordered by points, highest first, with ties going to the higher
+user id so every user has a distinct rank. Both orderings run the same way
+along a (points, user) index, so SQLite reads a page by walking that index
+backwards and never sorts. Pages continue from a cursor holding the last
+(rank, points, user id) returned rather than an OFFSET. A user's own rank is
+still a count of the index entries above theirs, so it costs more the
+higher they are; SQLite has no index that can answer it directly."""
+import base64
+from datetime import date, timedelta
+
+from django.conf import settings
+
+from main.db import add_counts
+from main.models import StudyUser, WeeklyScore
+
+def week_start(day=None):
+    day = day or date.today()
+    return day - timedelta(days=day.weekday())
+
+def weekly_enabled():
+    return getattr(settings, "LEADERBOARD_WEEKLY", True)
+
+def add_weekly_points(user, points):
+    """Adds points to the user's score for this week.
+    
+    Each week has its own rows, so a new week starts empty without any reset;
+    old weeks can be pruned with prune_weeks."""
+    if not weekly_enabled() or not points:
+        return
+    add_counts(WeeklyScore, ("week", "user"), [{ "week": week_start(), "user": user, "points": points }])
+        
+def prune_weeks(keep=8):
+    WeeklyScore.objects.filter(week__lt=week_start() - timedelta(weeks=keep)).delete()
+    
+def scores(week=None):
+    """The ranked queryset: overall, or for the week starting on `week`."""
+    if week is None:
+        return StudyUser.objects.all()
+    return WeeklyScore.objects.filter(week=week)
+    
+class BadCursor(ValueError):
+    pass
+    
+def encode_cursor(rank, points, user_id):
+    return base64.urlsafe_b64encode("%d.%d.%d" % (rank, points, user_id)).rstrip("=")
+    
+def decode_cursor(cursor):
+    """Returns the (rank, points, user id) a cursor continues after."""
+    try:
+        text = base64.urlsafe_b64decode(str(cursor) + "=" * (-len(cursor) % 4))
+        rank, points, user_id = [int(part) for part in text.split(".")]
+        return rank, points, user_id
+    except (TypeError, ValueError, UnicodeError):
+        raise BadCursor(cursor)
+        
+def ahead_of(rows, points, user_id):
+    """The rows ranked above a score of points held by user_id."""
+    return rows.filter(points__gte=points).exclude(points=points, user_id__lte=user_id)
+    
+def behind(rows, points, user_id):
+    """The rows ranked below a score of points held by user_id."""
+    return rows.filter(points__lte=points).exclude(points=points, user_id__gte=user_id)
+    
+def top(week=None, cursor=None, size=20):
+    """A page of the leaderboard as a list of (rank, username, points) and
+    the cursor for the next page, or None if this is the last."""
+    rows = scores(week)
+    start = 0
+    if cursor is not None:
+        start, points, user_id = decode_cursor(cursor)
+        rows = behind(rows, points, user_id)
+    rows = list(rows.order_by("-points", "-user_id")
+                    .values_list("user_id", "user__username", "points")[:size + 1])
+    more = len(rows) > size
+    rows = rows[:size]
+    entries = [(start + i + 1, username, points) for i, (user_id, username, points) in enumerate(rows)]
+    last = rows[-1] if rows else None
+    return entries, encode_cursor(start + len(rows), last[2], last[0]) if more else None
+    
+def rank(user, week=None):
+    """The user's (rank, points), or None if they have no score."""
+    points = scores(week).filter(user=user).values_list("points", flat=True).first()
+    if points is None:
+        return None
+    return ahead_of(scores(week), points, user.pk).count() + 1, points
@@ -0,0 +1,47 @@
+import timeit
+from datetime import date, timedelta
+
+from django.core import serializers
+from django.core.management.base import BaseCommand
+
+from main import encoding
+from main.models import Subject, Card, StudyUser
+
+def django_payload(cards, study_user, today):
+    """The payload as rest_get_cards used to build it, for comparison."""
+    data = serializers.serialize('json', cards)
+    final_data = "[{"
+    final_data += '"time_distance": ' + str((cards[0].date - today).days) + ", "
+    final_data += '"points": ' + str(study_user.points) + ", "
+    final_data += '"multiplier": ' + str(study_user.multiplier) + ", "
+    final_data += data[2:]
+    return final_data
+
+def encoded_payload(cards, study_user, today, content_type=encoding.JSON_TYPE):
+    return encoding.encode(encoding.deck(cards, study_user, today), content_type)
+
+class Command(BaseCommand):
+    help = "Times the card API serializers on an in-memory deck."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--cards", type=int, default=20, help="Cards due on the same day")
+        parser.add_argument("--number", type=int, default=2000, help="Payloads built per timing")
+        
+    def handle(self, *args, **options):
+        today = date.today()
+        subject = Subject(pk=1, name="Subject", colour=Subject.RED, days=["0"])
+        study_user = StudyUser(points=1234, multiplier=5, last_updated=today)
+        cards = [Card(pk=i, title="Subject Lecture %d" % i, subject=subject, points=10,
+                      date=today + timedelta(days=1), colour=subject.colour)
+                 for i in range(1, options["cards"] + 1)]
+        
+        paths = [("django json", django_payload), ("compact json", encoded_payload)]
+        if encoding.msgpack is not None:
+            paths.append(("compact msgpack",
+                          lambda *a: encoded_payload(*a, content_type=encoding.MSGPACK_TYPE)))
+            
+        number = options["number"]
+        for name, build in paths:
+            seconds = min(timeit.repeat(lambda: build(cards, study_user, today), number=number, repeat=3))
+            size = len(build(cards, study_user, today))
+            self.stdout.write("%-16s %8.1f us/payload %6d bytes" % (name, seconds / number * 1e6, size))
@@ -0,0 +1,123 @@
+import os, shutil, sqlite3, tempfile, threading, time
+
+from django.core.management.base import BaseCommand
+
+from main.db import apply_pragmas, sqlite_pragmas
+
+SCHEMA = """
+CREATE TABLE card (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+                   date DATE NOT NULL, points INTEGER NOT NULL, title VARCHAR(128) NOT NULL);
+CREATE INDEX card_user_date ON card (user_id, date);
+CREATE TABLE studyuser (user_id INTEGER PRIMARY KEY, points INTEGER NOT NULL, multiplier INTEGER NOT NULL);
+"""
+
+# (name, run the pragmas, keep one connection per thread), each changing one
+# thing from the row before so their effects can be told apart
+VARIANTS = (
+    ("default", False, False),
+    ("pragmas", True, False),
+    ("pooled", True, True),
+)
+
+class Workload(object):
+    """Readers fetch each user's next cards while writers clear cards, the two
+    halves of the card API, against one database file."""
+    def __init__(self, path, users, cards, pragmas, persistent):
+        self.path = path
+        self.users = users
+        self.pragmas = pragmas
+        self.persistent = persistent
+        self.lock = threading.Lock()
+        self.counts = { "reads": 0, "writes": 0, "errors": 0 }
+        connection = sqlite3.connect(path)
+        connection.executescript(SCHEMA)
+        for user in range(users):
+            connection.execute("INSERT INTO studyuser VALUES (?, 0, 1)", (user,))
+            connection.executemany("INSERT INTO card (user_id, date, points, title) VALUES (?, date('2016-07-25', ?), 10, 'card')",
+                                   [(user, "+%d days" % (i // 3)) for i in range(cards)])
+        connection.commit()
+        connection.close()
+        
+    def connect(self):
+        # Django's default is a five second timeout and a connection per request
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        if self.pragmas:
+            apply_pragmas(connection.cursor(), sqlite_pragmas())
+        return connection
+        
+    def read(self, connection, user):
+        connection.execute("SELECT id, title, points FROM card WHERE user_id = ? AND date = "
+                           "(SELECT MIN(date) FROM card WHERE user_id = ?)", (user, user)).fetchall()
+        connection.execute("SELECT points, multiplier FROM studyuser WHERE user_id = ?", (user,)).fetchone()
+        
+    def write(self, connection, user):
+        # As the app's backend does, so writers wait on busy_timeout
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT id, points FROM card WHERE user_id = ? ORDER BY date LIMIT 1", (user,)).fetchone()
+            if row is not None:
+                connection.execute("DELETE FROM card WHERE id = ?", (row[0],))
+                connection.execute("UPDATE studyuser SET points = points + ? * multiplier, multiplier = multiplier + 1 "
+                                   "WHERE user_id = ?", (row[1], user))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+            
+    def worker(self, kind, index, deadline):
+        connection = self.connect() if self.persistent else None
+        operation = self.read if kind == "reads" else self.write
+        done = errors = 0
+        while time.time() < deadline:
+            user = (index + done) % self.users
+            try:
+                if self.persistent:
+                    operation(connection, user)
+                else:
+                    per_request = self.connect()
+                    try:
+                        operation(per_request, user)
+                    finally:
+                        per_request.close()
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        with self.lock:
+            self.counts[kind] += done
+            self.counts["errors"] += errors
+            
+    def run(self, readers, writers, seconds):
+        deadline = time.time() + seconds
+        threads = [threading.Thread(target=self.worker, args=("reads", i, deadline)) for i in range(readers)]
+        threads += [threading.Thread(target=self.worker, args=("writes", i, deadline)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.counts
+
+class Command(BaseCommand):
+    help = ("Compares SQLite throughput under concurrent reads and writes with SQLite's defaults, "
+            "with the tuning pragmas, and with the pragmas and persistent connections.")
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--cards", type=int, default=600, help="Cards per user")
+        
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        try:
+            for name, pragmas, persistent in VARIANTS:
+                path = os.path.join(directory, name + ".sqlite3")
+                workload = Workload(path, options["users"], options["cards"], pragmas, persistent)
+                counts = workload.run(options["readers"], options["writers"], options["seconds"])
+                self.stdout.write("%-8s %8.0f reads/s %8.0f writes/s %6d errors" % (
+                    name,
+                    counts["reads"] / options["seconds"],
+                    counts["writes"] / options["seconds"],
+                    counts["errors"]))
+        finally:
+            shutil.rmtree(directory)
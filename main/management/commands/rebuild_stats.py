@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from main import stats
+
+class Command(BaseCommand):
+    help = "Recomputes the daily statistics rollups from the cards and the completion log."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("usernames", nargs="*", help="Only rebuild these users")
+        parser.add_argument("--check", action="store_true",
+                            help="Report users whose rollups differ instead of rebuilding them")
+        
+    def handle(self, *args, **options):
+        users = User.objects.order_by("pk")
+        if options["usernames"]:
+            users = users.filter(username__in=options["usernames"])
+        differ = 0
+        for user in users:
+            if options["check"]:
+                expected = dict((key, counts) for key, counts in stats.rebuild_rows(user).items()
+                                if any(counts.values()))
+                if expected != stats.stored_rows(user):
+                    differ += 1
+                    self.stdout.write("%s: rollups differ" % user.username)
+            else:
+                rows = stats.rebuild(user)
+                self.stdout.write("%s: %d row%s" % (user.username, rows, "" if rows == 1 else "s"))
+        if options["check"]:
+            self.stdout.write("%d user%s differ" % (differ, "" if differ == 1 else "s"))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from main.jobs import POLL_SECONDS, run_pending_jobs
+
+class Command(BaseCommand):
+    help = "Runs queued create-cards jobs, polling the queue until stopped."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain the queue and exit")
+        
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write("Ran %d job%s" % (count, "" if count == 1 else "s"))
+            if options["once"]:
+                return
+            connection.close()
+            time.sleep(POLL_SECONDS)
@@ -0,0 +1,260 @@
+import json, logging, multiprocessing, os, random, tempfile, threading, time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections, OperationalError
+from django.test import Client
+
+from main.models import Subject, Card, StudyUser
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def seed(users, cards):
+    """Creates users whose cards are all worth one point, so that a user who
+    cleared n cards without lost updates has n(n+1)/2 points."""
+    today = date.today()
+    for i in range(users):
+        user = User(username="soak%d" % i)
+        user.set_unusable_password()
+        user.save()
+        StudyUser.objects.create(user=user, last_updated=today)
+        subject = Subject.objects.create(user=user, name="Soak", colour=Subject.RED, days=["0"])
+        Card.objects.bulk_create([Card(title="Soak Lecture %d" % j, subject=subject, points=1,
+                                       date=today + timedelta(days=j // 5), user=user, colour=subject.colour)
+                                  for j in range(cards)])
+
+class ThreadClient(Client):
+    """A test client that only re-raises exceptions from its own thread's requests.
+    
+    The stock client listens to the global got_request_exception signal, so with
+    several threads it would pick up other threads' errors."""
+    def __init__(self, *args, **kwargs):
+        super(ThreadClient, self).__init__(*args, **kwargs)
+        self.thread = threading.current_thread()
+        
+    def store_exc_info(self, **kwargs):
+        if threading.current_thread() is self.thread:
+            super(ThreadClient, self).store_exc_info(**kwargs)
+
+def server_timing(response, name):
+    """The duration in milliseconds of one metric in a Server-Timing header."""
+    for metric in response.get("Server-Timing", "").split(","):
+        parts = metric.strip().split(";")
+        if parts[0] == name:
+            for part in parts[1:]:
+                if part.startswith("dur="):
+                    return float(part[4:])
+    return 0.0
+    
+class Worker(object):
+    """Plays a student: fetches the next cards and clears one of them, sometimes
+    twice in a row like a double-clicked Done button."""
+    def __init__(self, users, deadline, double_click):
+        self.users = users
+        self.deadline = deadline
+        self.double_click = double_click
+        self.stats = { "gets": 0, "clears": 0, "cleared": {}, "not_found": 0,
+                       "errors": 0, "lock_errors": 0, "lock_wait": 0.0,
+                       "get_times": [], "clear_times": [] }
+        
+    def timed(self, kind, call):
+        start = time.time()
+        try:
+            response = call()
+        except OperationalError:
+            # Time spent waiting for a lock that was never granted
+            self.stats["lock_errors"] += 1
+            self.stats["lock_wait"] += time.time() - start
+            return None
+        except Exception:
+            self.stats["errors"] += 1
+            return None
+        self.stats[kind + "_times"].append((time.time() - start) * 1000)
+        # Time spent waiting for locks that were granted, from Server-Timing
+        self.stats["lock_wait"] += server_timing(response, "lock") / 1000
+        if response.status_code >= 500:
+            self.stats["errors"] += 1
+        return response
+        
+    def clear(self, client, user, card_id):
+        response = self.timed("clear", lambda: client.delete("/studyhero/rest/cards/",
+                                                             json.dumps({ "id": card_id }),
+                                                             content_type="application/json"))
+        if response is None:
+            return
+        self.stats["clears"] += 1
+        if response.status_code == 200:
+            self.stats["cleared"][user.pk] = self.stats["cleared"].get(user.pk, 0) + 1
+        elif response.status_code == 404:
+            self.stats["not_found"] += 1
+            
+    def login(self, user):
+        # Logging in writes the session, so do it once per user rather than per request
+        while True:
+            try:
+                client = ThreadClient(SERVER_NAME="localhost")
+                client.force_login(user)
+                return client
+            except OperationalError:
+                time.sleep(0.01)
+                
+    def run(self):
+        clients = {}
+        while time.time() < self.deadline:
+            user = random.choice(self.users)
+            if user.pk not in clients:
+                clients[user.pk] = self.login(user)
+            client = clients[user.pk]
+            response = self.timed("get", lambda: client.get("/studyhero/rest/cards/"))
+            if response is None or response.status_code != 200:
+                continue
+            self.stats["gets"] += 1
+            cards = json.loads(response.content)["cards"]
+            if not cards:
+                continue
+            card_id = random.choice(cards)[0]
+            self.clear(client, user, card_id)
+            if random.random() < self.double_click:
+                self.clear(client, user, card_id)
+        connections.close_all()
+        
+def merge(total, stats):
+    for key, value in stats.items():
+        if key == "cleared":
+            for user_id, count in value.items():
+                total[key][user_id] = total[key].get(user_id, 0) + count
+        else:
+            total[key] += value
+    return total
+
+def run_threads(users, threads, deadline, double_click, results=None):
+    workers = [Worker(users, deadline, double_click) for i in range(threads)]
+    running = [threading.Thread(target=worker.run) for worker in workers]
+    for thread in running:
+        thread.start()
+    for thread in running:
+        thread.join()
+    total = Worker(users, deadline, double_click).stats
+    for worker in workers:
+        merge(total, worker.stats)
+    if results is not None:
+        results.put(total)
+    return total
+
+class Command(BaseCommand):
+    help = ("Drives rest_get_cards and rest_clear_card from many threads and processes "
+            "against a scratch SQLite file and reports throughput, lock errors and lost updates.")
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=2)
+        parser.add_argument("--threads", type=int, default=4, help="Threads per process")
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--cards", type=int, default=200, help="Cards per user")
+        parser.add_argument("--double-click", type=float, default=0.1,
+                            help="Chance of clearing the same card twice in a row")
+        parser.add_argument("--database", help="SQLite file to use (default: a new temporary file)")
+        parser.add_argument("--no-pragmas", action="store_true", help="Skip SQLITE_PRAGMAS")
+        parser.add_argument("--conn-max-age", type=int, help="Override CONN_MAX_AGE")
+        parser.add_argument("--label", default="", help="Name for this configuration in the report")
+        parser.add_argument("--output", help="Append the report as a JSON line to this file")
+        parser.add_argument("--compare", help="Print the reports saved in this file side by side and exit")
+        
+    def handle(self, *args, **options):
+        if options["compare"]:
+            return self.compare(options["compare"])
+            
+        path = options["database"] or os.path.join(tempfile.mkdtemp(), "soak.sqlite3")
+        if options["database"] and os.path.exists(path):
+            self.stderr.write("Refusing to reuse existing database %s" % path)
+            return
+        # Failed requests are counted in the report rather than logged
+        logging.getLogger("django.request").disabled = True
+        connections.close_all()
+        database = connections.databases["default"]
+        database["NAME"] = path
+        if options["conn_max_age"] is not None:
+            database["CONN_MAX_AGE"] = options["conn_max_age"]
+        if options["no_pragmas"]:
+            settings.SQLITE_PRAGMAS = ()
+        if "localhost" not in settings.ALLOWED_HOSTS and "*" not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ["localhost"]
+            
+        call_command("migrate", verbosity=0)
+        seed(options["users"], options["cards"])
+        users = list(User.objects.filter(username__startswith="soak"))
+        connections.close_all()
+        
+        deadline = time.time() + options["seconds"]
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=run_threads,
+                                             args=(users, options["threads"], deadline,
+                                                   options["double_click"], results))
+                     for i in range(options["processes"])]
+        for process in processes:
+            process.start()
+        total = Worker(users, deadline, 0).stats
+        for process in processes:
+            merge(total, results.get())
+        for process in processes:
+            process.join()
+            
+        self.report(options, path, total)
+        
+    def report(self, options, path, total):
+        # With every card worth one point, n clears must give n(n+1)/2 points
+        anomalies = 0
+        for study_user in StudyUser.objects.filter(user__username__startswith="soak"):
+            cleared = options["cards"] - Card.objects.filter(user=study_user.user).count()
+            if total["cleared"].get(study_user.user_id, 0) != cleared \
+                    or study_user.multiplier != cleared + 1 \
+                    or study_user.points != cleared * (cleared + 1) // 2:
+                anomalies += 1
+        journal_mode = connections["default"].cursor().execute("PRAGMA journal_mode").fetchone()[0]
+        
+        seconds = options["seconds"]
+        requests = total["gets"] + total["clears"]
+        failures = total["errors"] + total["lock_errors"]
+        report = {
+            "label": options["label"],
+            "database": path,
+            "journal_mode": journal_mode,
+            "conn_max_age": connections.databases["default"]["CONN_MAX_AGE"],
+            "workers": options["processes"] * options["threads"],
+            "requests_per_second": requests / seconds,
+            "clears_per_second": total["clears"] / seconds,
+            "get_p50_ms": percentile(total["get_times"], 0.5),
+            "get_p99_ms": percentile(total["get_times"], 0.99),
+            "clear_p50_ms": percentile(total["clear_times"], 0.5),
+            "clear_p99_ms": percentile(total["clear_times"], 0.99),
+            "error_rate": float(failures) / max(1, requests + failures),
+            "lock_errors": total["lock_errors"],
+            "lock_wait_seconds": total["lock_wait"],
+            "duplicate_clears_rejected": total["not_found"],
+            "lost_update_users": anomalies,
+        }
+        for key in sorted(report):
+            value = report[key]
+            self.stdout.write("%-26s %s" % (key, "%.2f" % value if isinstance(value, float) else value))
+        if options["output"]:
+            with open(options["output"], "a") as output:
+                output.write(json.dumps(report, sort_keys=True) + "\n")
+            
+    def compare(self, filename):
+        with open(filename) as saved:
+            reports = [json.loads(line) for line in saved if line.strip()]
+        columns = ("label", "journal_mode", "conn_max_age", "workers", "requests_per_second",
+                   "clears_per_second", "clear_p99_ms", "error_rate", "lock_errors", "lost_update_users")
+        widths = [max(len(column), 8) for column in columns]
+        self.stdout.write(" ".join("%-*s" % (width, column) for width, column in zip(widths, columns)))
+        for report in reports:
+            values = ["%.2f" % report[column] if isinstance(report[column], float) else str(report[column])
+                      for column in columns]
+            self.stdout.write(" ".join("%-*s" % (width, value) for width, value in zip(widths, values)))
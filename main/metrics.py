@@ -0,0 +1,115 @@
+"""Per-request timing and per-view histograms.
+
+The middleware opens a RequestTimings for each request on the current thread;
+the database backend, template backend and serializers add to it. Finished
+requests are folded into histograms keyed by URL name, which render_metrics
+writes out in the Prometheus text format."""
+import threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from main import events
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+# Per-process counters for the next-cards cache, kept by main.caching
+CACHE_STATS = { "hits": 0, "misses": 0 }
+
+_local = threading.local()
+
+class RequestTimings(object):
+    def __init__(self):
+        self.start = time.time()
+        self.queries = 0
+        # "lock" is the part of "db" spent waiting for SQLite's write lock
+        self.seconds = { "db": 0.0, "lock": 0.0, "template": 0.0, "serialize": 0.0 }
+        
+    def total(self):
+        return time.time() - self.start
+
+def start_request():
+    _local.timings = RequestTimings()
+    return _local.timings
+    
+def finish_request():
+    timings = getattr(_local, "timings", None)
+    _local.timings = None
+    return timings
+    
+def current():
+    return getattr(_local, "timings", None)
+
+def record_query(seconds):
+    timings = current()
+    if timings is not None:
+        timings.queries += 1
+        timings.seconds["db"] += seconds
+        
+@contextmanager
+def timer(part):
+    """Adds the time spent in the block to the current request's part."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings = current()
+        if timings is not None:
+            timings.seconds[part] += time.time() - start
+            
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        
+class Registry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        
+    def histogram(self, metric, view, buckets):
+        key = (metric, view)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(buckets)
+        return self.histograms[key]
+        
+    def observe(self, view, timings, total):
+        with self.lock:
+            self.histogram("request_duration_seconds", view, SECONDS_BUCKETS).observe(total)
+            self.histogram("request_queries", view, QUERY_BUCKETS).observe(timings.queries)
+            for part, seconds in timings.seconds.items():
+                self.histogram("request_%s_seconds" % part, view, SECONDS_BUCKETS).observe(seconds)
+                
+    def render(self):
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            lines = []
+            last_metric = None
+            for (metric, view), histogram in histograms:
+                name = "studyhero_" + metric
+                if metric != last_metric:
+                    lines.append("# TYPE %s histogram" % name)
+                    last_metric = metric
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{view="%s",le="%s"} %d' % (name, view, bound, cumulative))
+                lines.append('%s_sum{view="%s"} %s' % (name, view, histogram.sum))
+                lines.append('%s_count{view="%s"} %d' % (name, view, histogram.count))
+        lines.append("# TYPE studyhero_next_cards_cache_hits_total counter")
+        lines.append("studyhero_next_cards_cache_hits_total %d" % CACHE_STATS["hits"])
+        lines.append("# TYPE studyhero_next_cards_cache_misses_total counter")
+        lines.append("studyhero_next_cards_cache_misses_total %d" % CACHE_STATS["misses"])
+        lines.append("# TYPE studyhero_event_streams gauge")
+        lines.append("studyhero_event_streams %d" % events.hub.count())
+        return "\n".join(lines) + "\n"
+        
+registry = Registry()
@@ -0,0 +1,45 @@
+from django.core.exceptions import MiddlewareNotUsed
+
+from main import metrics, profiling
+
+class RequestMetricsMiddleware(object):
+    """Times each request, splitting out database, template and serialisation
+    time, reports it in a Server-Timing header and adds it to the histograms."""
+    def process_request(self, request):
+        metrics.start_request()
+        
+    def process_response(self, request, response):
+        timings = metrics.finish_request()
+        if timings is None:
+            return response
+        total = timings.total()
+        
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match is not None and match.url_name else "unresolved"
+        metrics.registry.observe(view, timings, total)
+        
+        response["Server-Timing"] = ", ".join([
+            'db;dur=%.2f;desc="%d queries"' % (timings.seconds["db"] * 1000, timings.queries),
+            "lock;dur=%.2f" % (timings.seconds["lock"] * 1000),
+            "tpl;dur=%.2f" % (timings.seconds["template"] * 1000),
+            "ser;dur=%.2f" % (timings.seconds["serialize"] * 1000),
+            "total;dur=%.2f" % (total * 1000),
+        ])
+        return response
+
+class ProfilerMiddleware(object):
+    """Profiles a sample of requests, or slow ones, when PROFILER["ENABLED"] is set."""
+    def __init__(self):
+        options = profiling.config()
+        if not options["ENABLED"]:
+            raise MiddlewareNotUsed()
+        self.profiler = profiling.Profiler(options)
+        
+    def process_request(self, request):
+        self.profiler.start(request)
+        
+    def process_response(self, request, response):
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match is not None and match.url_name else "unresolved"
+        self.profiler.finish(request, view)
+        return response
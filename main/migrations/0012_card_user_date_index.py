@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 14:42
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_auto_20161116_0524'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='card',
+            index_together=set([('user', 'date')]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import main.models
+
+
+def list_to_mask(apps, schema_editor):
+    Subject = apps.get_model("main", "Subject")
+    for subject in Subject.objects.all():
+        subject.days_mask = subject.days
+        subject.save(update_fields=["days_mask"])
+
+def mask_to_list(apps, schema_editor):
+    Subject = apps.get_model("main", "Subject")
+    for subject in Subject.objects.all():
+        subject.days = subject.days_mask
+        subject.save(update_fields=["days"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_card_user_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subject',
+            name='days_mask',
+            field=main.models.DaysField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(list_to_mask, mask_to_list),
+        # Gives the old column a default so that it can be re-added on reverse
+        migrations.AlterField(
+            model_name='subject',
+            name='days',
+            field=main.models.ListField(default='[]'),
+        ),
+        migrations.RemoveField(
+            model_name='subject',
+            name='days',
+        ),
+        migrations.RenameField(
+            model_name='subject',
+            old_name='days_mask',
+            new_name='days',
+        ),
+    ]
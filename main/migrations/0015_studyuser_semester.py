@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 14:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_cardjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studyuser',
+            name='commence',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='studyuser',
+            name='midsem_break',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
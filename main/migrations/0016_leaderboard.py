@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 14:55
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0015_studyuser_semester'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyScore',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week', models.DateField()),
+                ('points', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='studyuser',
+            index_together=set([('points', 'user')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='weeklyscore',
+            unique_together=set([('week', 'user')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='weeklyscore',
+            index_together=set([('week', 'points', 'user')]),
+        ),
+    ]
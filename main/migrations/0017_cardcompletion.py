@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 14:56
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0016_leaderboard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardCompletion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card_id', models.IntegerField()),
+                ('subject_id', models.IntegerField()),
+                ('title', models.CharField(max_length=128)),
+                ('date', models.DateField()),
+                ('card_points', models.IntegerField()),
+                ('multiplier', models.IntegerField()),
+                ('points', models.IntegerField()),
+                ('cleared_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='cardcompletion',
+            index_together=set([('user', 'cleared_at'), ('subject_id', 'date')]),
+        ),
+    ]
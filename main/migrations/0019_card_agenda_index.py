@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 15:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_dailystats'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='card',
+            index_together=set([('user', 'date', 'id')]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 15:06
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0019_card_agenda_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedCard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card_id', models.IntegerField()),
+                ('version', models.IntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='studyuser',
+            name='reset_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='studyuser',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='card',
+            index_together=set([('user', 'date', 'id'), ('user', 'version')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='deletedcard',
+            index_together=set([('user', 'version')]),
+        ),
+    ]
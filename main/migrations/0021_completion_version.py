@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 15:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_sync_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardcompletion',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='cardcompletion',
+            index_together=set([('user', 'cleared_at'), ('subject_id', 'date'), ('user', 'version')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def backfill(apps, schema_editor):
+    """Builds the rollups of decks that existed before DailyStats did, and
+    replaces any rows their clears have made since."""
+    from main.stats import tally
+    
+    Card = apps.get_model("main", "Card")
+    CardCompletion = apps.get_model("main", "CardCompletion")
+    DailyStats = apps.get_model("main", "DailyStats")
+    StudyUser = apps.get_model("main", "StudyUser")
+    
+    DailyStats.objects.all().delete()
+    for user_id, built_at in StudyUser.objects.values_list("user_id", "built_at"):
+        rows = tally(Card.objects.filter(user_id=user_id).values_list("subject_id", "date"),
+                     CardCompletion.objects.filter(user_id=user_id)
+                                   .values_list("subject_id", "date", "points", "cleared_at"),
+                     built_at)
+        DailyStats.objects.bulk_create([DailyStats(user_id=user_id, subject_id=subject_id, day=day, **counts)
+                                        for (subject_id, day), counts in rows.items() if any(counts.values())])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_completion_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
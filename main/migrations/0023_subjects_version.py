@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 15:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_backfill_dailystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studyuser',
+            name='subjects_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
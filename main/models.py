@@ -1,8 +1,11 @@
 from __future__ import unicode_literals
 import ast, calendar
 
+from django import forms
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils.text import capfirst
 
 class ListField(models.TextField):
     # __metaclass__ = models.SubfieldBase
@@ -36,6 +39,88 @@ class ListField(models.TextField):
         value = self._get_val_from_obj(obj)
         return self.get_db_prep_value(value)
 
+# Every combination of the seven weekday bits, decoded once
+DAY_MASKS = [tuple(str(day) for day in range(0, 7) if mask & (1 << day)) for mask in range(0, 1 << 7)]
+
+WEEKDAYS = [(str(i), calendar.day_name[i]) for i in range(0, 7)]
+
+def days_to_mask(days):
+    mask = 0
+    for day in days:
+        mask |= 1 << int(day)
+    return mask
+    
+def mask_to_days(mask):
+    return list(DAY_MASKS[mask])
+
+class DaysField(models.Field):
+    description = "Stores a list of weekdays as an integer bitmask"
+    
+    def get_internal_type(self):
+        return "PositiveSmallIntegerField"
+        
+    def to_python(self, value):
+        if not value:
+            return []
+            
+        if isinstance(value, (list, tuple)):
+            return [unicode(day) for day in value]
+            
+        try:
+            if isinstance(value, basestring) and value.strip().startswith("["):
+                # The list repr the field was serialized as before it was a mask
+                return [unicode(int(day)) for day in ast.literal_eval(value)]
+            return mask_to_days(int(value))
+        except (ValueError, TypeError, SyntaxError, IndexError):
+            raise ValidationError("Enter a list of weekdays.", code="invalid")
+        
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return value
+            
+        return mask_to_days(value)
+        
+    def formfield(self, **kwargs):
+        defaults = {
+            "required": not self.blank,
+            "label": capfirst(self.verbose_name),
+            "help_text": self.help_text,
+            "choices": getattr(self.model, "DAYS", WEEKDAYS),
+            "widget": forms.CheckboxSelectMultiple,
+        }
+        defaults.update(kwargs)
+        return forms.MultipleChoiceField(**defaults)
+        
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+            
+        if isinstance(value, (list, tuple)):
+            return days_to_mask(value)
+            
+        return int(value)
+        
+    def value_to_string(self, obj):
+        value = self._get_val_from_obj(obj)
+        return str(self.get_prep_value(value))
+        
+class HasDay(models.Lookup):
+    """Matches rows whose days include the given weekday, e.g. days__has_day=1."""
+    lookup_name = "has_day"
+    
+    def get_prep_lookup(self):
+        return 1 << int(self.rhs)
+        
+    def get_db_prep_lookup(self, value, connection):
+        return "%s", [value]
+        
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return "(%s & %s) != 0" % (lhs, rhs), lhs_params + rhs_params
+        
+DaysField.register_lookup(HasDay)
+
 class Subject(models.Model):
     RED = "0"
     YELLOW = "1"
@@ -52,7 +137,7 @@ class Subject(models.Model):
 
     name = models.CharField(max_length=50)
     colour = models.CharField(max_length=6, choices=COLOURS)
-    days = ListField()
+    days = DaysField()
     user = models.ForeignKey(User)
     
     def __unicode__(self):
@@ -71,15 +156,159 @@ class Card(models.Model):
     date = models.DateField()
     user = models.ForeignKey(User)
     colour = models.CharField(max_length=6, choices=Subject.COLOURS)
+    # The user's change version when the card was created; see main.sync
+    version = models.IntegerField(default=0)
     
     def __unicode__(self):
         return self.title + " " + str(self.date)
         
+    class Meta:
+        # The first backs the next-due lookup in get_next_cards and the
+        # agenda's pages; the second backs the cards inserted since a sync
+        index_together = (
+            ("user", "date", "id"),
+            ("user", "version"),
+        )
+        
+class DeletedCard(models.Model):
+    """A tombstone for a card that was deleted without being cleared, so
+    clients that sync can drop it; see main.sync."""
+    user = models.ForeignKey(User)
+    card_id = models.IntegerField()
+    version = models.IntegerField()
+    
+    def __unicode__(self):
+        return self.user.username + " " + str(self.card_id)
+        
+    class Meta:
+        index_together = (
+            ("user", "version"),
+        )
+        
+class CardCompletion(models.Model):
+    """An append-only record of a cleared card, written as the card is deleted."""
+    user = models.ForeignKey(User)
+    # Plain ids rather than foreign keys, so history outlives the card and subject
+    card_id = models.IntegerField()
+    subject_id = models.IntegerField()
+    title = models.CharField(max_length=128)
+    date = models.DateField()
+    card_points = models.IntegerField()
+    multiplier = models.IntegerField()
+    points = models.IntegerField()
+    cleared_at = models.DateTimeField()
+    # The user's version after the clear; the completion is the card's
+    # tombstone in a sync (see main.sync)
+    version = models.IntegerField(default=0)
+    
+    def __unicode__(self):
+        return self.title + " " + str(self.cleared_at)
+        
+    class Meta:
+        index_together = (
+            ("user", "cleared_at"),
+            ("subject_id", "date"),
+            ("user", "version"),
+        )
+        
+class DailyStats(models.Model):
+    """Rolled-up counts for one user, subject and day; see main.stats.
+    
+    scheduled and completed count the current deck's cards by due date;
+    cleared and points count clears by the day they happened."""
+    user = models.ForeignKey(User)
+    subject_id = models.IntegerField()
+    day = models.DateField()
+    scheduled = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    cleared = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+    
+    def __unicode__(self):
+        return self.user.username + " " + str(self.day)
+        
+    class Meta:
+        unique_together = (
+            ("user", "subject_id", "day"),
+        )
+        index_together = (
+            ("user", "day"),
+        )
+        
 class StudyUser(models.Model):
     user = models.OneToOneField(User)
     points = models.IntegerField(default=0)
     multiplier = models.IntegerField(default=1)
     last_updated = models.DateField()
+    # The semester the deck was last built for, used to add subjects later
+    commence = models.DateField(null=True, blank=True)
+    midsem_break = models.DateField(null=True, blank=True)
+    # When the deck was last rebuilt; earlier completions belong to an old deck
+    built_at = models.DateTimeField(null=True, blank=True)
+    # Raised by every change to the user's cards or score (see main.sync);
+    # clients synced from before reset_version must refetch the whole deck
+    version = models.IntegerField(default=0)
+    reset_version = models.IntegerField(default=0)
+    # Raised only when the subject list changes; keys its cached fragment
+    subjects_version = models.IntegerField(default=0)
     
     def __unicode__(self):
-        return self.user.username
\ No newline at end of file
+        return self.user.username
+        
+    class Meta:
+        # Backs the leaderboard's pages and rank counts
+        index_together = (
+            ("points", "user"),
+        )
+        
+class WeeklyScore(models.Model):
+    """Points a user earned in the week starting on `week` (a Monday)."""
+    user = models.ForeignKey(User)
+    week = models.DateField()
+    points = models.IntegerField(default=0)
+    
+    def __unicode__(self):
+        return self.user.username + " " + str(self.week)
+        
+    class Meta:
+        unique_together = (
+            ("week", "user"),
+        )
+        index_together = (
+            ("week", "points", "user"),
+        )
+        
+class CardJob(models.Model):
+    """A queued run of create_cards; see main.jobs."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    
+    STATUSES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+    
+    # One job per user and kind, reused when the same work is asked for again
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User)
+    commence = models.DateField()
+    midsem_break = models.DateField()
+    status = models.CharField(max_length=8, choices=STATUSES, default=QUEUED)
+    # Bumped on each requeue, so a worker can tell if its run went stale
+    run = models.IntegerField(default=0)
+    progress = models.IntegerField(default=0)
+    cards = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    updated = models.DateTimeField()
+    
+    def __unicode__(self):
+        return self.key + " " + self.status
+        
+    class Meta:
+        index_together = (
+            ("status", "updated"),
+        )
@@ -0,0 +1,152 @@
+"""Opt-in request profiling.
+
+A PROFILER["SAMPLE_RATE"] fraction of requests run under cProfile, and when
+PROFILER["SLOW_THRESHOLD_MS"] is set every request's thread has its stack
+sampled by a background thread, keeping the samples of requests slower than
+the threshold. Saved profiles are rate limited and rotated in
+PROFILER["DIRECTORY"]."""
+import cProfile, os, random, re, sys, threading, time, uuid
+from collections import Counter
+
+from django.conf import settings
+
+DEFAULTS = {
+    "ENABLED": False,
+    "SAMPLE_RATE": 0.01,
+    "SLOW_THRESHOLD_MS": None,
+    "SAMPLE_INTERVAL_MS": 5,
+    "MAX_PER_MINUTE": 10,
+    "KEEP": 100,
+    "DIRECTORY": os.path.join(settings.BASE_DIR, "profiles"),
+}
+
+# cProfile output is a .prof (pstats) file; stack samples are folded stacks
+PROFILE_NAME = re.compile(r"^[\w.-]+\.(prof|folded)$")
+
+def config():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, "PROFILER", {}))
+    return options
+    
+class RateLimiter(object):
+    """A token bucket allowing `per_minute` saves a minute."""
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+        
+    def allow(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60.0)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+            
+class StackSampler(object):
+    """Samples the stacks of registered threads from one background thread."""
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = {}
+        self.thread = None
+        
+    def start(self, thread_id):
+        with self.lock:
+            self.active[thread_id] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="profiling-sampler")
+                self.thread.daemon = True
+                self.thread.start()
+                
+    def stop(self, thread_id):
+        with self.lock:
+            return self.active.pop(thread_id, Counter())
+            
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[fold(frame)] += 1
+                        
+def fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+    
+class Profiler(object):
+    def __init__(self, options):
+        self.options = options
+        self.limiter = RateLimiter(options["MAX_PER_MINUTE"])
+        self.sampler = StackSampler(options["SAMPLE_INTERVAL_MS"] / 1000.0)
+        
+    def start(self, request):
+        if random.random() < self.options["SAMPLE_RATE"]:
+            request._profile = cProfile.Profile()
+            request._profile.enable()
+        elif self.options["SLOW_THRESHOLD_MS"] is not None:
+            request._profile_thread = threading.current_thread().ident
+            self.sampler.start(request._profile_thread)
+        request._profile_start = time.time()
+        
+    def finish(self, request, view):
+        if not hasattr(request, "_profile_start"):
+            return
+        elapsed_ms = (time.time() - request._profile_start) * 1000
+        profile = getattr(request, "_profile", None)
+        if profile is not None:
+            profile.disable()
+            if self.limiter.allow():
+                self.save(view, elapsed_ms, "prof", lambda path: profile.dump_stats(path))
+        elif hasattr(request, "_profile_thread"):
+            stacks = self.sampler.stop(request._profile_thread)
+            if stacks and elapsed_ms >= self.options["SLOW_THRESHOLD_MS"] and self.limiter.allow():
+                self.save(view, elapsed_ms, "folded", lambda path: write_folded(path, stacks))
+                
+    def save(self, view, elapsed_ms, extension, write):
+        directory = self.options["DIRECTORY"]
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # The random part keeps concurrent requests in the same second apart
+        name = "%s-%s-%dms-%s.%s" % (time.strftime("%Y%m%d-%H%M%S"), view, elapsed_ms,
+                                     uuid.uuid4().hex[:12], extension)
+        write(os.path.join(directory, name))
+        self.rotate()
+        
+    def rotate(self):
+        for name in list_profiles(self.options["DIRECTORY"])[self.options["KEEP"]:]:
+            try:
+                os.remove(os.path.join(self.options["DIRECTORY"], name))
+            except OSError:
+                pass
+                
+def write_folded(path, stacks):
+    with open(path, "w") as output:
+        for stack, count in stacks.most_common():
+            output.write("%s %d\n" % (stack, count))
+            
+def list_profiles(directory):
+    """Saved profile names, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if PROFILE_NAME.match(name)]
+    return sorted(names, key=lambda name: os.path.getmtime(os.path.join(directory, name)), reverse=True)
+    
+def profile_path(name):
+    """The path of a saved profile, or None if the name is not one."""
+    directory = config()["DIRECTORY"]
+    if not PROFILE_NAME.match(name) or not os.path.isfile(os.path.join(directory, name)):
+        return None
+    return os.path.join(directory, name)
@@ -0,0 +1,74 @@
+from collections import namedtuple
+from datetime import timedelta
+from itertools import product
+
+ONE_DAY_POINTS = 10
+ONE_WEEK_POINTS = 5
+ONE_MONTH_POINTS = 2
+
+SEMESTER_WEEKS = 12
+
+# Time delays for each round of cards
+TIME_DELAYS_POINTS = (
+    (timedelta(days=1), ONE_DAY_POINTS),
+    (timedelta(weeks=1), ONE_WEEK_POINTS),
+    (timedelta(weeks=4), ONE_MONTH_POINTS),
+)
+
+PlannedCard = namedtuple("PlannedCard", ("title", "subject", "points", "date"))
+
+def card_key(subject_id, title, points, date):
+    return (subject_id, title, points, date)
+
+class Schedule(object):
+    """The semester plan for a set of subjects, computed without touching the database.
+    
+    The week start dates (including the mid-semester break skip) are worked out
+    once, so each subject is just the product of weeks x lecture days x delays."""
+    def __init__(self, commence, midsem_break):
+        self.commence = commence
+        self.midsem_break = midsem_break
+        self.week_dates = self._week_dates()
+        
+    def _week_dates(self):
+        week_dates = []
+        week_date = self.commence
+        skipped_break = False
+        for i in range(0, SEMESTER_WEEKS):
+            week_dates.append(week_date)
+            week_date += timedelta(weeks=1)
+            if week_date >= self.midsem_break and not skipped_break:
+                week_date += timedelta(weeks=1)
+                skipped_break = True
+        return week_dates
+        
+    def subject_cards(self, subject):
+        offsets = [timedelta(days=int(day)) for day in subject.days]
+        # Lectures are numbered in order through each week's lecture days
+        for (week, week_date), (day, offset), (delay, points) in product(enumerate(self.week_dates),
+                                                                         enumerate(offsets),
+                                                                         TIME_DELAYS_POINTS):
+            lecture_number = week * len(offsets) + day + 1
+            yield PlannedCard(subject.name + " Lecture " + str(lecture_number),
+                              subject,
+                              points,
+                              week_date + offset + delay)
+            
+    def cards(self, subjects):
+        planned = []
+        for subject in subjects:
+            planned.extend(self.subject_cards(subject))
+        return planned
+        
+    def diff(self, subjects, cards):
+        """Compares the plan against stored cards.
+        
+        Returns (missing, extra): planned cards that are not stored, and stored
+        cards that are not planned."""
+        planned = dict((card_key(card.subject.pk, card.title, card.points, card.date), card)
+                       for card in self.cards(subjects))
+        stored = dict((card_key(card.subject_id, card.title, card.points, card.date), card)
+                      for card in cards)
+        missing = [card for key, card in planned.items() if key not in stored]
+        extra = [card for key, card in stored.items() if key not in planned]
+        return missing, extra
@@ -0,0 +1,67 @@
+"""The dashboard state: the user's score and the cards they have due next.
+
+Both come from one query, cards joined to their StudyUser and restricted to
+the earliest due date by a subquery, with a lone StudyUser fetch only when the
+deck is empty. The state is kept on the user object for the rest of the
+request, so later readers in the same request do not query again."""
+from collections import namedtuple
+from datetime import datetime
+
+from main import sync
+from main.models import Card, StudyUser
+
+StudyState = namedtuple("StudyState", ("study_user", "cards"))
+
+# Restricts a user's cards to their earliest due date within the same query
+EARLIEST_DATE = ('"main_card"."date" = (SELECT MIN("date") FROM "main_card" AS "due" '
+                 'WHERE "due"."user_id" = %s)')
+
+def due_cards(user):
+    """The cards due on the user's earliest due date, in id order."""
+    return Card.objects.filter(user=user).extra(where=[EARLIEST_DATE], params=[user.pk]).order_by("pk")
+    
+def load(user, today=None):
+    """Returns the user's StudyState, rolling the day over first if needed."""
+    state = getattr(user, "_study_state", None)
+    if state is None:
+        cards = list(due_cards(user).select_related("user__studyuser"))
+        if cards:
+            study_user = cards[0].user.studyuser
+        else:
+            study_user = StudyUser.objects.get(user=user)
+        state = StudyState(study_user, cards)
+        roll_over(state, today or datetime.now().date())
+        sync.remember_version(user, study_user.version)
+        user._study_state = state
+    return state
+    
+def forget(user):
+    """Drops the state kept on the user, after their score or deck changes."""
+    if hasattr(user, "_study_state"):
+        del user._study_state
+    sync.forget_version(user)
+    
+def roll_over(state, today):
+    """Starts a new day: the multiplier is lost if a card is overdue.
+    
+    Only runs a statement when the day has changed, and the update is
+    conditional on it, so concurrent requests on a new day reset it once; the
+    request that loses the race reloads the row instead. A reset multiplier
+    is a score change, so it raises the sync version, conditional on the
+    version read so the new one is known."""
+    study_user = state.study_user
+    if study_user.last_updated == today:
+        return
+    changes = { "last_updated": today }
+    rows = StudyUser.objects.filter(pk=study_user.pk).exclude(last_updated=today)
+    if state.cards and today > state.cards[0].date:
+        changes["multiplier"] = 1
+        changes["version"] = study_user.version + 1
+        rows = rows.filter(version=study_user.version)
+    if rows.update(**changes):
+        for field, value in changes.items():
+            setattr(study_user, field, value)
+    else:
+        # Another request rolled the day over or changed the score first
+        study_user.refresh_from_db()
+        roll_over(state, today)
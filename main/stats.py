@@ -0,0 +1,145 @@
+"""Daily study statistics kept as rollups.
+
+Each DailyStats row holds counts for one user, subject and day. The rows are
+changed by the same code that changes the deck: replace_deck when it is
+rebuilt, add_cards/remove_cards for a single subject, and record_clears when
+cards are cleared. Summaries for charts are read from the rollups only.
+rebuild recomputes a user's rows from Card and CardCompletion, and is used
+by `manage.py rebuild_stats`."""
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from main.db import add_counts
+from main.models import Card, CardCompletion, DailyStats, StudyUser, Subject
+
+COUNTS = ("scheduled", "completed", "cleared", "points")
+
+def local_day(moment):
+    return timezone.localtime(moment).date() if timezone.is_aware(moment) else moment.date()
+
+def add(user, deltas):
+    """Adds deltas[(subject_id, day)] = { field: amount } to the user's rows,
+    creating rows that do not exist yet (see main.db.add_counts)."""
+    add_counts(DailyStats, ("user", "subject_id", "day"),
+               [dict(changes, user=user, subject_id=subject_id, day=day)
+                for (subject_id, day), changes in deltas.items() if any(changes.values())])
+            
+def count_cards(cards):
+    counts = defaultdict(int)
+    for card in cards:
+        counts[(card.subject_id, card.date)] += 1
+    return counts
+    
+def replace_deck(user, cards):
+    """The user's deck was rebuilt from `cards`: nothing in it is completed yet."""
+    DailyStats.objects.filter(user=user).exclude(scheduled=0, completed=0).update(scheduled=0, completed=0)
+    add(user, dict((key, { "scheduled": count }) for key, count in count_cards(cards).items()))
+    
+def add_cards(user, cards):
+    add(user, dict((key, { "scheduled": count }) for key, count in count_cards(cards).items()))
+    
+def remove_cards(user, keys):
+    """Outstanding cards at the given (subject_id, day) keys were deleted."""
+    counts = defaultdict(int)
+    for key in keys:
+        counts[key] -= 1
+    add(user, dict((key, { "scheduled": count }) for key, count in counts.items()))
+    
+def remove_subject(user, subject_ids):
+    """A subject was deleted: its outstanding cards are no longer scheduled."""
+    DailyStats.objects.filter(user=user, subject_id__in=subject_ids).update(scheduled=F("completed"))
+    
+def record_clears(user, completions):
+    deltas = defaultdict(lambda: defaultdict(int))
+    for completion in completions:
+        deltas[(completion.subject_id, completion.date)]["completed"] += 1
+        today = (completion.subject_id, local_day(completion.cleared_at))
+        deltas[today]["cleared"] += 1
+        deltas[today]["points"] += completion.points
+    add(user, deltas)
+    
+def tally(cards, completions, built_at=None):
+    """Computes rollup rows from the (subject_id, date) of each card and the
+    (subject_id, date, points, cleared_at) of each completion."""
+    rows = defaultdict(lambda: dict((field, 0) for field in COUNTS))
+    for subject_id, day in cards:
+        rows[(subject_id, day)]["scheduled"] += 1
+    for subject_id, day, points, cleared_at in completions:
+        if built_at is None or cleared_at >= built_at:
+            rows[(subject_id, day)]["scheduled"] += 1
+            rows[(subject_id, day)]["completed"] += 1
+        today = rows[(subject_id, local_day(cleared_at))]
+        today["cleared"] += 1
+        today["points"] += points
+    return rows
+    
+def rebuild_rows(user):
+    """Computes the user's rollup rows from scratch, without saving them."""
+    built_at = StudyUser.objects.filter(user=user).values_list("built_at", flat=True).first()
+    return tally(Card.objects.filter(user=user).values_list("subject_id", "date"),
+                 CardCompletion.objects.filter(user=user).values_list("subject_id", "date", "points", "cleared_at"),
+                 built_at)
+    
+def stored_rows(user):
+    rows = {}
+    for row in DailyStats.objects.filter(user=user):
+        if any(getattr(row, field) for field in COUNTS):
+            rows[(row.subject_id, row.day)] = dict((field, getattr(row, field)) for field in COUNTS)
+    return rows
+    
+def rebuild(user):
+    """Replaces the user's rollups with freshly computed ones."""
+    rows = rebuild_rows(user)
+    with transaction.atomic():
+        DailyStats.objects.filter(user=user).delete()
+        DailyStats.objects.bulk_create([DailyStats(user=user, subject_id=subject_id, day=day, **counts)
+                                        for (subject_id, day), counts in rows.items()])
+    return len(rows)
+    
+def summary(user, days=28, today=None):
+    """Chart data for the user, read from the rollups."""
+    today = today or date.today()
+    rows = DailyStats.objects.filter(user=user)
+    
+    names = dict(Subject.objects.filter(user=user).values_list("pk", "name"))
+    subjects = []
+    for subject_id, scheduled, completed in rows.filter(day__lt=today).values_list("subject_id") \
+                                                .annotate(Sum("scheduled"), Sum("completed")).order_by("subject_id"):
+        if subject_id in names and scheduled:
+            subjects.append({ "id": subject_id, "name": names[subject_id],
+                              "scheduled": scheduled, "completed": completed,
+                              "rate": float(completed) / scheduled })
+            
+    overdue = rows.filter(day__lt=today).aggregate(overdue=Sum(F("scheduled") - F("completed")))["overdue"] or 0
+    
+    start = today - timedelta(days=days - 1)
+    daily = dict((day, (cleared, points)) for day, cleared, points in
+                 rows.filter(day__gte=start, day__lte=today).values_list("day")
+                     .annotate(Sum("cleared"), Sum("points")).order_by("day"))
+    series = []
+    weeks = defaultdict(int)
+    for i in range(days):
+        day = start + timedelta(days=i)
+        cleared, points = daily.get(day, (0, 0))
+        series.append({ "day": day.isoformat(), "cleared": cleared, "points": points })
+        weeks[day - timedelta(days=day.weekday())] += points
+        
+    # Consecutive days, ending today or yesterday, with at least one clear
+    active = set(rows.filter(cleared__gt=0, day__lte=today).values_list("day", flat=True).distinct())
+    day = today if today in active else today - timedelta(days=1)
+    streak = 0
+    while day in active:
+        streak += 1
+        day -= timedelta(days=1)
+        
+    return {
+        "streak": streak,
+        "overdue": overdue,
+        "subjects": subjects,
+        "days": series,
+        "weeks": [{ "week": week.isoformat(), "points": points } for week, points in sorted(weeks.items())],
+    }
@@ -0,0 +1,84 @@
+"""Versioned delta sync for clients that keep their own copy of the deck.
+
+Every change to a user's cards or score raises StudyUser.version in the
+same statement that makes it, or beside it in the same transaction. New
+cards are stamped with the version that created them. A cleared card's
+CardCompletion carries the version of the clear, and other deleted cards
+leave a DeletedCard tombstone, so the changes since a version are index
+ranges. Rebuilding the whole deck sets reset_version instead of writing a
+tombstone per card: clients from before it are sent the whole deck."""
+from django.db.models import F
+
+from main.models import Card, CardCompletion, DeletedCard, StudyUser
+
+# Column order of each entry in a sync's "cards" array
+SYNC_FIELDS = ("id", "title", "subject", "colour", "points", "date")
+
+def current_version(user):
+    """The user's version, read once per request and remembered on the user
+    (main.auth loads it along with the user)."""
+    version = getattr(user, "_version", None)
+    if version is None:
+        version = StudyUser.objects.filter(user=user).values_list("version", flat=True).first() or 0
+        remember_version(user, version)
+    return version
+    
+def remember_version(user, version):
+    user._version = version
+    
+def forget_version(user):
+    if getattr(user, "_version", None) is not None:
+        user._version = None
+        
+def next_version(user, current=None, **changes):
+    """Raises the user's version, applying any other StudyUser changes in the
+    same statement, and returns the new version.
+    
+    A caller that has read the version under the write lock passes it as
+    current, which saves reading the new one back."""
+    study_users = StudyUser.objects.filter(user=user)
+    study_users.update(version=F("version") + 1, **changes)
+    if current is None:
+        version = study_users.values_list("version", flat=True).get()
+    else:
+        version = current + 1
+    remember_version(user, version)
+    return version
+    
+def reset(user, **changes):
+    """Raises the version for a rebuilt deck; earlier tombstones are no longer needed."""
+    version = next_version(user, reset_version=F("version") + 1, **changes)
+    DeletedCard.objects.filter(user=user).delete()
+    return version
+    
+def record_deleted(user, card_ids, version):
+    DeletedCard.objects.bulk_create([DeletedCard(user=user, card_id=card_id, version=version)
+                                     for card_id in card_ids])
+    
+def changes(user, since=None):
+    """Returns what changed in the user's deck and score after version since.
+    
+    Without a usable version (none given, from before the last rebuild, or
+    ahead of the server) the whole deck is sent with "reset" set."""
+    version, reset_version, points, multiplier = StudyUser.objects.filter(user=user) \
+        .values_list("version", "reset_version", "points", "multiplier").get()
+    full = since is None or since <= 0 or since < reset_version or since > version
+    cards = Card.objects.filter(user=user)
+    deleted = []
+    if not full:
+        cards = cards.filter(version__gt=since)
+        tombstones = list(DeletedCard.objects.filter(user=user, version__gt=since).values_list("version", "card_id"))
+        tombstones.extend(CardCompletion.objects.filter(user=user, version__gt=since).values_list("version", "card_id"))
+        deleted = [card_id for deleted_version, card_id in sorted(tombstones)]
+    colours = dict(Card._meta.get_field("colour").flatchoices)
+    rows = cards.order_by("date", "pk").values_list("pk", "title", "subject_id", "colour", "points", "date")
+    return {
+        "version": version,
+        "reset": full,
+        "fields": SYNC_FIELDS,
+        "cards": [[pk, title, subject_id, colours.get(colour, colour), card_points, date.isoformat()]
+                  for pk, title, subject_id, colour, card_points, date in rows],
+        "deleted": deleted,
+        "points": points,
+        "multiplier": multiplier,
+    }
@@ -0,0 +1,103 @@
+"""Latency and query-count budgets for the card lifecycle.
+
+Seeds USERS users with SUBJECTS subjects of DAYS lecture days each, then drives
+every hot entry point through the test client and reports p50/p95/p99 latency
+and the most SQL statements seen per operation. A test fails when an operation
+goes over its budget. The population and budgets can be changed with the
+STUDYHERO_BENCH_* environment variables and the BENCHMARK_BUDGETS setting."""
+import os, sys, time
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from main.jobs import run_pending_jobs
+from main.models import Subject, Card, StudyUser
+
+USERS = int(os.environ.get("STUDYHERO_BENCH_USERS", 5))
+SUBJECTS = int(os.environ.get("STUDYHERO_BENCH_SUBJECTS", 4))
+DAYS = int(os.environ.get("STUDYHERO_BENCH_DAYS", 2))
+
+# Operation -> (most SQL statements, p95 latency in milliseconds)
+BUDGETS = {
+    "create-cards": (11, 50),
+    "card job": (20, 500),
+    "rest-card GET cold": (4, 50),
+    "rest-card GET": (3, 20),
+    "rest-card DELETE": (10, 50),
+    "index": (4, 50),
+    "delete-subject": (13, 100),
+}
+BUDGETS.update(getattr(settings, "BENCHMARK_BUDGETS", {}))
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+class Measurements(object):
+    def __init__(self):
+        self.times = {}
+        self.queries = {}
+        
+    def measure(self, name, call):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            response = call()
+            elapsed = (time.time() - start) * 1000
+        self.times.setdefault(name, []).append(elapsed)
+        self.queries[name] = max(self.queries.get(name, 0), len(queries))
+        return response
+        
+    def report(self):
+        lines = ["%-20s %8s %8s %8s %8s" % ("operation", "p50 ms", "p95 ms", "p99 ms", "queries")]
+        for name in sorted(self.times):
+            samples = self.times[name]
+            lines.append("%-20s %8.2f %8.2f %8.2f %8d" % (name, percentile(samples, 0.5),
+                                                         percentile(samples, 0.95),
+                                                         percentile(samples, 0.99),
+                                                         self.queries[name]))
+        return "\n".join(lines)
+
+class CardLifecycleBenchmark(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = []
+        for i in range(USERS):
+            user = User.objects.create_user(username="bench%d" % i, password="password")
+            StudyUser.objects.create(user=user, last_updated=date.today())
+            for j in range(SUBJECTS):
+                Subject.objects.create(user=user, name="Subject %d" % j, colour=str(j),
+                                       days=[str(day) for day in range(DAYS)])
+            self.users.append(user)
+            
+    def test_card_lifecycle(self):
+        results = Measurements()
+        for user in self.users:
+            self.client.force_login(user)
+            results.measure("create-cards", lambda: self.client.post("/studyhero/create-cards/",
+                                                                     { "commence": "2016-07-25",
+                                                                       "break": "2016-09-26" }))
+            results.measure("card job", run_pending_jobs)
+            results.measure("index", lambda: self.client.get("/studyhero/"))
+            for card in Card.objects.filter(user=user).order_by("date", "pk")[:10]:
+                cache.clear()
+                results.measure("rest-card GET cold", lambda: self.client.get("/studyhero/rest/cards/"))
+                results.measure("rest-card GET", lambda: self.client.get("/studyhero/rest/cards/"))
+                results.measure("rest-card DELETE", lambda: self.client.delete(
+                    "/studyhero/rest/cards/", '{ "id": "%d" }' % card.pk, content_type="application/json"))
+            for subject in Subject.objects.filter(user=user):
+                results.measure("delete-subject", lambda: self.client.post(
+                    "/studyhero/delete-subject/?name=" + subject.name, { "confirm": "yes" }))
+                
+        sys.stderr.write("\n" + results.report() + "\n")
+        for name, (max_queries, max_p95) in sorted(BUDGETS.items()):
+            if name not in results.times:
+                continue
+            self.assertLessEqual(results.queries[name], max_queries,
+                                 "%s issued %d statements" % (name, results.queries[name]))
+            p95 = percentile(results.times[name], 0.95)
+            self.assertLessEqual(p95, max_p95, "%s took %.1f ms at p95" % (name, p95))
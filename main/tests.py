@@ -1,3 +1,754 @@
-from django.test import TestCase
+from datetime import date, timedelta
+import json, os, shutil, tempfile
+from collections import Counter
+from importlib import import_module
+from unittest import skipIf
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main.models import Subject, Card, CardCompletion, CardJob, DailyStats, DeletedCard, StudyUser, WeeklyScore, days_to_mask, mask_to_days
+from main.schedule import Schedule, ONE_DAY_POINTS
+from main.cards import create_all_cards, sync_subject_cards
+from main.jobs import STALE_SECONDS, claim_next_job, enqueue_card_job, run_job, run_pending_jobs
+from main import db, encoding, events, leaderboard, profiling, state, stats
+from main.views import get_next_cards
+
+COMMENCE = date(2016, 7, 25)
+MIDSEM_BREAK = date(2016, 9, 26)
+
+def make_user(username="student", subjects=0, days=None):
+    user = User.objects.create_user(username=username, password="password")
+    StudyUser.objects.create(user=user, last_updated=date.today())
+    for i in range(subjects):
+        Subject.objects.create(user=user, name="Subject %d" % i, colour=str(i),
+                               days=days or ["0"])
+    return user
+    
+class DeckTestCase(TestCase):
+    """Logs in a user with SUBJECTS subjects on DAYS and, unless BUILD_DECK
+    is off, builds their semester's deck."""
+    SUBJECTS = 1
+    DAYS = None
+    BUILD_DECK = True
+    
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(subjects=self.SUBJECTS, days=self.DAYS)
+        if self.BUILD_DECK:
+            create_all_cards(self.user, COMMENCE, MIDSEM_BREAK)
+        self.client.login(username="student", password="password")
+
+class CreateAllCardsTests(TestCase):
+    def test_creates_whole_semester(self):
+        user = make_user(subjects=2, days=["0", "2"])
+        created = create_all_cards(user, COMMENCE, MIDSEM_BREAK)
+        # 2 subjects x 12 weeks x 2 days x 3 delays
+        self.assertEqual(created, 144)
+        self.assertEqual(Card.objects.filter(user=user).count(), 144)
+        
+    def test_regenerating_replaces_deck(self):
+        user = make_user(subjects=1)
+        create_all_cards(user, COMMENCE, MIDSEM_BREAK)
+        create_all_cards(user, COMMENCE, MIDSEM_BREAK)
+        self.assertEqual(Card.objects.filter(user=user).count(), 36)
+        
+    def test_statements_independent_of_subject_count(self):
+        one = make_user("one", subjects=1)
+        five = make_user("five", subjects=5)
+        with CaptureQueriesContext(connection) as one_queries:
+            create_all_cards(one, COMMENCE, MIDSEM_BREAK)
+        with CaptureQueriesContext(connection) as five_queries:
+            create_all_cards(five, COMMENCE, MIDSEM_BREAK)
+        # Only the bulk inserts may grow, and only by the backend's batch size
+        fields = [f for f in Card._meta.concrete_fields if not f.primary_key]
+        batch_size = connection.ops.bulk_batch_size(fields, []) or 180
+        inserts = [q for q in five_queries if q["sql"].startswith("INSERT") and "main_card" in q["sql"]]
+        self.assertEqual(len(inserts), -(-180 // batch_size))
+        others = lambda queries: [q for q in queries if not q["sql"].startswith("INSERT")]
+        self.assertEqual(len(others(one_queries)), len(others(five_queries)))
+
+class GetNextCardsTests(TestCase):
+    def test_empty_deck(self):
+        user = make_user()
+        self.assertEqual(get_next_cards(user), [])
+        
+    def test_returns_only_earliest_date(self):
+        user = make_user(subjects=1, days=["0", "1"])
+        create_all_cards(user, COMMENCE, MIDSEM_BREAK)
+        cards = get_next_cards(user)
+        first_date = Card.objects.filter(user=user).order_by("date")[0].date
+        self.assertTrue(cards)
+        self.assertTrue(all(card.date == first_date for card in cards))
+        self.assertEqual(len(cards), Card.objects.filter(user=user, date=first_date).count())
+
+class ScheduleTests(TestCase):
+    def test_skips_midsem_break(self):
+        schedule = Schedule(COMMENCE, MIDSEM_BREAK)
+        self.assertEqual(len(schedule.week_dates), 12)
+        self.assertNotIn(MIDSEM_BREAK, schedule.week_dates)
+        self.assertEqual(schedule.week_dates[-1], COMMENCE + timedelta(weeks=12))
+        
+    def test_lecture_numbering(self):
+        subject = Subject(name="Maths", colour="0", days=["0", "3"])
+        planned = list(Schedule(COMMENCE, MIDSEM_BREAK).subject_cards(subject))
+        self.assertEqual(len(planned), 72)
+        self.assertEqual(planned[0].title, "Maths Lecture 1")
+        self.assertEqual(planned[0].points, ONE_DAY_POINTS)
+        self.assertEqual(planned[0].date, COMMENCE + timedelta(days=1))
+        self.assertEqual(planned[3].title, "Maths Lecture 2")
+        self.assertEqual(planned[3].date, COMMENCE + timedelta(days=4))
+        
+    def test_preview_does_not_write(self):
+        user = make_user(subjects=1)
+        create_all_cards(user, COMMENCE, MIDSEM_BREAK)
+        self.client.login(username="student", password="password")
+        response = self.client.get("/studyhero/preview-cards/",
+                                   { "commence": "2016-08-01", "break": "2016-09-26" })
+        data = json.loads(response.content)
+        self.assertEqual(data["count"], 36)
+        self.assertEqual(data["added"], 36)
+        self.assertEqual(data["removed"], 36)
+        self.assertEqual(Card.objects.filter(user=user, date=COMMENCE + timedelta(days=1)).count(), 1)
+
+class DaysFieldTests(TestCase):
+    def test_mask_round_trip(self):
+        self.assertEqual(days_to_mask(["0", "2", "4"]), 0b10101)
+        self.assertEqual(mask_to_days(0b10101), ["0", "2", "4"])
+        self.assertEqual(mask_to_days(0), [])
+        
+    def test_stored_as_list(self):
+        user = make_user(subjects=1, days=["1", "3"])
+        self.assertEqual(Subject.objects.get(user=user).days, ["1", "3"])
+        
+    def test_query_by_weekday(self):
+        user = make_user()
+        Subject.objects.create(user=user, name="Tuesday", colour="0", days=["1"])
+        Subject.objects.create(user=user, name="Both", colour="1", days=["1", "3"])
+        Subject.objects.create(user=user, name="Monday", colour="2", days=["0"])
+        names = set(Subject.objects.filter(days__has_day=1).values_list("name", flat=True))
+        self.assertEqual(names, set(["Tuesday", "Both"]))
+        
+    def test_parses_legacy_repr(self):
+        field = Subject._meta.get_field("days")
+        self.assertEqual(field.to_python("['0', '2']"), ["0", "2"])
+        self.assertEqual(field.to_python("5"), ["0", "2"])
+        self.assertRaises(ValidationError, field.to_python, "Monday")
+        
+    def test_admin_round_trip(self):
+        user = make_user(subjects=1, days=["0", "2"])
+        subject = Subject.objects.get(user=user)
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        url = "/admin/main/subject/%d/change/" % subject.pk
+        self.assertContains(self.client.get(url), 'type="checkbox"')
+        response = self.client.post(url, { "name": subject.name, "colour": subject.colour,
+                                           "days": ["1", "3"], "user": user.pk })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Subject.objects.get(pk=subject.pk).days, ["1", "3"])
+
+class ImmediateTransactionTests(TransactionTestCase):
+    def test_atomic_takes_the_write_lock_first(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Card.objects.count()
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
+        
+class ClearCardTests(DeckTestCase):
+    def clear(self, card_id):
+        return self.client.delete("/studyhero/rest/cards/", json.dumps({ "id": str(card_id) }),
+                                  content_type="application/json")
+        
+    def test_awards_points_and_returns_totals(self):
+        card = Card.objects.filter(user=self.user, points=ONE_DAY_POINTS)[0]
+        response = self.clear(card.pk)
+        self.assertEqual(json.loads(response.content), { "points": ONE_DAY_POINTS, "multiplier": 2 })
+        study_user = StudyUser.objects.get(user=self.user)
+        self.assertEqual((study_user.points, study_user.multiplier), (ONE_DAY_POINTS, 2))
+        self.assertFalse(Card.objects.filter(pk=card.pk).exists())
+        
+    def test_clearing_twice_awards_once(self):
+        card = Card.objects.filter(user=self.user)[0]
+        self.clear(card.pk)
+        self.assertEqual(self.clear(card.pk).status_code, 404)
+        self.assertEqual(StudyUser.objects.get(user=self.user).multiplier, 2)
+        
+    def test_other_users_card(self):
+        other = make_user("other", subjects=1)
+        create_all_cards(other, COMMENCE, MIDSEM_BREAK)
+        card = Card.objects.filter(user=other)[0]
+        self.assertEqual(self.clear(card.pk).status_code, 404)
+        self.assertTrue(Card.objects.filter(pk=card.pk).exists())
+        
+    def test_batch_clear_returns_deck(self):
+        first, second = Card.objects.filter(user=self.user, points=ONE_DAY_POINTS).order_by("date")[:2]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete("/studyhero/rest/cards/",
+                                          json.dumps({ "ids": [first.pk, second.pk, first.pk] }),
+                                          content_type="application/json")
+        data = json.loads(response.content)
+        self.assertEqual(len([q for q in queries if q["sql"].startswith('DELETE FROM "main_card"')]), 1)
+        self.assertEqual(data["cleared"], [first.pk, second.pk])
+        # The multiplier goes up after the first card
+        self.assertEqual(data["points"], ONE_DAY_POINTS * 1 + ONE_DAY_POINTS * 2)
+        self.assertEqual(data["multiplier"], 3)
+        self.assertEqual([row[0] for row in data["cards"]],
+                         [card.pk for card in get_next_cards(self.user)])
+
+class NextCardsCacheTests(DeckTestCase):
+    def test_sessions_from_the_stock_backend_still_resolve(self):
+        session = self.client.session
+        session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+        session.save()
+        self.assertEqual(self.client.get("/studyhero/rest/cards/").status_code, 200)
+        
+    def test_second_get_is_a_hit(self):
+        self.assertEqual(self.client.get("/studyhero/rest/cards/")["X-Cache"], "miss")
+        with self.assertNumQueries(2):
+            # Only the session and user lookups remain
+            response = self.client.get("/studyhero/rest/cards/")
+        self.assertEqual(response["X-Cache"], "hit")
+        
+    def test_clear_invalidates(self):
+        first = json.loads(self.client.get("/studyhero/rest/cards/").content)
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "id": str(first["cards"][0][0]) }),
+                           content_type="application/json")
+        response = self.client.get("/studyhero/rest/cards/")
+        self.assertEqual(response["X-Cache"], "miss")
+        self.assertNotEqual(json.loads(response.content)["cards"][0][0], first["cards"][0][0])
+        
+    def test_regenerate_invalidates(self):
+        self.client.get("/studyhero/rest/cards/")
+        create_all_cards(self.user, COMMENCE + timedelta(weeks=1), MIDSEM_BREAK)
+        data = json.loads(self.client.get("/studyhero/rest/cards/").content)
+        self.assertEqual(data["date"], (COMMENCE + timedelta(weeks=1, days=1)).isoformat())
+        
+    def test_conditional_get(self):
+        etag = self.client.get("/studyhero/rest/cards/")["ETag"]
+        with self.assertNumQueries(2):
+            response = self.client.get("/studyhero/rest/cards/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        card = Card.objects.filter(user=self.user)[0]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "id": str(card.pk) }),
+                           content_type="application/json")
+        response = self.client.get("/studyhero/rest/cards/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        
+    def test_change_in_another_process_invalidates(self):
+        etag = self.client.get("/studyhero/rest/cards/")["ETag"]
+        # Another process clears a card: this process's cache never heard of it
+        card = get_next_cards(self.user)[0]
+        card.delete()
+        StudyUser.objects.filter(user=self.user).update(version=F("version") + 1)
+        response = self.client.get("/studyhero/rest/cards/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Cache"], "miss")
+        self.assertNotIn(card.pk, [row[0] for row in json.loads(response.content)["cards"]])
+
+class CardEncodingTests(DeckTestCase):
+    BUILD_DECK = False
+    
+    def test_empty_deck(self):
+        data = json.loads(self.client.get("/studyhero/rest/cards/").content)
+        self.assertEqual(data["cards"], [])
+        self.assertEqual(data["points"], 0)
+        self.assertIsNone(data["date"])
+        
+    def test_schema(self):
+        create_all_cards(self.user, COMMENCE, MIDSEM_BREAK)
+        response = self.client.get("/studyhero/rest/cards/")
+        data = json.loads(response.content)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(data["date"], (COMMENCE + timedelta(days=1)).isoformat())
+        self.assertEqual(data["time_distance"], (COMMENCE + timedelta(days=1) - date.today()).days)
+        self.assertEqual(data["fields"], ["id", "title", "subject", "colour", "points"])
+        card = Card.objects.get(pk=data["cards"][0][0])
+        self.assertEqual(data["cards"][0], [card.pk, "Subject 0 Lecture 1", card.subject_id, "Red", ONE_DAY_POINTS])
+        
+    @skipIf(encoding.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        create_all_cards(self.user, COMMENCE, MIDSEM_BREAK)
+        expected = json.loads(self.client.get("/studyhero/rest/cards/").content)
+        response = self.client.get("/studyhero/rest/cards/", HTTP_ACCEPT=encoding.MSGPACK_TYPE)
+        self.assertEqual(response["Content-Type"], encoding.MSGPACK_TYPE)
+        self.assertEqual(encoding.msgpack.unpackb(response.content, raw=False), expected)
+        
+    @skipIf(encoding.msgpack is None, "msgpack is not installed")
+    def test_negotiate(self):
+        self.assertEqual(encoding.negotiate("application/x-msgpack;q=0"), encoding.JSON_TYPE)
+        self.assertEqual(encoding.negotiate("application/x-msgpack;q=0, */*"), encoding.JSON_TYPE)
+        self.assertEqual(encoding.negotiate("application/json;q=0.5, application/x-msgpack"), encoding.MSGPACK_TYPE)
+        self.assertEqual(encoding.negotiate("*/*, application/x-msgpack"), encoding.MSGPACK_TYPE)
+        self.assertEqual(encoding.negotiate("application/*, application/x-msgpack;q=0.9"), encoding.JSON_TYPE)
+        self.assertEqual(encoding.negotiate(None), encoding.JSON_TYPE)
+
+class RequestMetricsTests(TestCase):
+    def test_server_timing(self):
+        make_user(subjects=1)
+        self.client.login(username="student", password="password")
+        timing = self.client.get("/studyhero/")["Server-Timing"]
+        self.assertIn("db;dur=", timing)
+        self.assertIn("lock;dur=", timing)
+        self.assertIn("tpl;dur=", timing)
+        self.assertIn("total;dur=", timing)
+        
+    def test_metrics_staff_only(self):
+        user = make_user()
+        self.client.login(username="student", password="password")
+        self.assertEqual(self.client.get("/studyhero/metrics/").status_code, 302)
+        user.is_staff = True
+        user.save()
+        self.client.get("/studyhero/")
+        body = self.client.get("/studyhero/metrics/").content
+        self.assertIn('studyhero_request_duration_seconds_count{view="index"}', body)
+        self.assertIn('studyhero_request_queries_bucket{view="index",le="+Inf"}', body)
+
+class ProfilerTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def test_sampled_request_is_saved_and_viewable(self):
+        user = make_user()
+        user.is_staff = True
+        user.save()
+        self.client.login(username="student", password="password")
+        with self.settings(PROFILER={ "ENABLED": True, "SAMPLE_RATE": 1.0, "DIRECTORY": self.directory }):
+            self.client.get("/studyhero/")
+        names = os.listdir(self.directory)
+        self.assertEqual(len(names), 1)
+        self.assertIn("-index-", names[0])
+        with self.settings(PROFILER={ "DIRECTORY": self.directory }):
+            response = self.client.get("/studyhero/profiles/", { "name": names[0] })
+            self.assertContains(response, "cumulative")
+            response = self.client.get("/studyhero/profiles/", { "name": "../settings.py" })
+            self.assertEqual(response.status_code, 404)
+            
+    def test_same_second_saves_do_not_collide(self):
+        options = dict(profiling.config(), DIRECTORY=self.directory)
+        profiler = profiling.Profiler(options)
+        for i in range(2):
+            profiler.save("index", 5, "folded", lambda path: profiling.write_folded(path, Counter(["a;b"])))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+class CardJobTests(DeckTestCase):
+    SUBJECTS = 2
+    BUILD_DECK = False
+    
+    def test_post_queues_and_worker_creates(self):
+        response = self.client.post("/studyhero/create-cards/", { "commence": "2016-07-25", "break": "2016-09-26" },
+                                    HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        job = json.loads(response.content)
+        self.assertEqual(job["status"], CardJob.QUEUED)
+        self.assertFalse(Card.objects.filter(user=self.user).exists())
+        
+        self.assertEqual(run_pending_jobs(), 1)
+        status = json.loads(self.client.get("/studyhero/rest/jobs/%d/" % job["id"]).content)
+        self.assertEqual((status["status"], status["progress"], status["cards"]), (CardJob.DONE, 100, 72))
+        self.assertEqual(Card.objects.filter(user=self.user).count(), 72)
+        
+    def test_same_request_is_idempotent(self):
+        first = enqueue_card_job(self.user, COMMENCE, MIDSEM_BREAK)
+        second = enqueue_card_job(self.user, COMMENCE, MIDSEM_BREAK)
+        self.assertEqual((first.pk, first.run), (second.pk, second.run))
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(run_pending_jobs(), 0)
+        
+    def test_new_dates_requeue(self):
+        enqueue_card_job(self.user, COMMENCE, MIDSEM_BREAK)
+        run_pending_jobs()
+        job = enqueue_card_job(self.user, COMMENCE + timedelta(weeks=1), MIDSEM_BREAK)
+        self.assertEqual((job.status, job.run), (CardJob.QUEUED, 1))
+        run_pending_jobs()
+        self.assertEqual(get_next_cards(self.user)[0].date, COMMENCE + timedelta(weeks=1, days=1))
+        
+    def test_other_users_job(self):
+        job = enqueue_card_job(make_user("other"), COMMENCE, MIDSEM_BREAK)
+        self.assertEqual(self.client.get("/studyhero/rest/jobs/%d/" % job.pk).status_code, 404)
+        
+    def test_stale_running_job_is_reclaimed(self):
+        job = enqueue_card_job(self.user, COMMENCE, MIDSEM_BREAK)
+        self.assertEqual(claim_next_job().run, 0)
+        self.assertIsNone(claim_next_job())
+        CardJob.objects.filter(pk=job.pk).update(updated=timezone.now() - timedelta(seconds=STALE_SECONDS + 1))
+        self.assertEqual(claim_next_job().run, 1)
+        
+    def test_superseded_run_leaves_deck_alone(self):
+        enqueue_card_job(self.user, COMMENCE, MIDSEM_BREAK)
+        job = claim_next_job()
+        enqueue_card_job(self.user, COMMENCE + timedelta(weeks=1), MIDSEM_BREAK)
+        run_job(job)
+        self.assertFalse(Card.objects.filter(user=self.user).exists())
+        self.assertEqual(CardJob.objects.get(pk=job.pk).status, CardJob.QUEUED)
+
+class IncrementalDeckTests(DeckTestCase):
+    def test_new_subject_keeps_cleared_cards(self):
+        card = get_next_cards(self.user)[0]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "id": str(card.pk) }),
+                           content_type="application/json")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post("/studyhero/new-subject/", { "name": "Physics", "colour": "2", "days": ["1"] })
+        inserts = [q for q in queries if q["sql"].startswith("INSERT") and "main_card" in q["sql"]]
+        self.assertEqual(len(inserts), 1)
+        self.assertFalse(Card.objects.filter(pk=card.pk).exists())
+        self.assertEqual(Card.objects.filter(user=self.user, subject__name="Physics").count(), 36)
+        self.assertEqual(Card.objects.filter(user=self.user).count(), 36 - 1 + 36)
+        
+    def test_sync_writes_only_the_difference(self):
+        subject = Subject.objects.get(user=self.user)
+        self.assertEqual(sync_subject_cards(subject, COMMENCE, MIDSEM_BREAK), (0, 0))
+        subject.days = ["0", "2"]
+        subject.save()
+        # Lecture numbers shift when a day is added, so most titles change
+        inserted, deleted = sync_subject_cards(subject, COMMENCE, MIDSEM_BREAK)
+        self.assertEqual(Card.objects.filter(subject=subject).count(), 72)
+        self.assertEqual(inserted - deleted, 36)
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for username, points in (("alice", 50), ("bob", 80), ("carol", 50), ("student", 10)):
+            user = make_user(username)
+            StudyUser.objects.filter(user=user).update(points=points)
+        self.user = User.objects.get(username="student")
+        self.client.login(username="student", password="password")
+        
+    def test_pages_and_rank(self):
+        data = json.loads(self.client.get("/studyhero/rest/leaderboard/", { "size": 2 }).content)
+        self.assertEqual([(e["rank"], e["username"]) for e in data["entries"]], [(1, "bob"), (2, "carol")])
+        self.assertEqual(data["me"], { "rank": 4, "points": 10 })
+        data = json.loads(self.client.get("/studyhero/rest/leaderboard/", { "size": 2, "cursor": data["next"] }).content)
+        self.assertEqual([(e["rank"], e["username"]) for e in data["entries"]], [(3, "alice"), (4, "student")])
+        self.assertIsNone(data["next"])
+        self.assertEqual(self.client.get("/studyhero/rest/leaderboard/", { "cursor": "x" }).status_code, 400)
+        
+    def test_pages_do_not_sort(self):
+        cursor = leaderboard.encode_cursor(2, 50, self.user.pk)
+        for week in (None, leaderboard.week_start()):
+            rows = leaderboard.behind(leaderboard.scores(week), 50, self.user.pk).order_by("-points", "-user_id") \
+                              .values_list("user_id", "user__username", "points")
+            with connection.cursor() as c:
+                sql, params = rows.query.sql_with_params()
+                c.execute("EXPLAIN QUERY PLAN " + sql, params)
+                plan = " ".join(row[-1] for row in c.fetchall())
+            self.assertNotIn("TEMP B-TREE", plan)
+        self.assertEqual(leaderboard.decode_cursor(cursor), (2, 50, self.user.pk))
+        
+    def test_clearing_updates_weekly_board(self):
+        Subject.objects.create(user=self.user, name="Maths", colour="0", days=["0"])
+        create_all_cards(self.user, COMMENCE, MIDSEM_BREAK)
+        first, second = get_next_cards(self.user)[0], Card.objects.filter(user=self.user).order_by("date")[1]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "ids": [first.pk, second.pk] }),
+                           content_type="application/json")
+        awarded = first.points * 1 + second.points * 2
+        self.assertEqual(WeeklyScore.objects.get(user=self.user).points, awarded)
+        data = json.loads(self.client.get("/studyhero/rest/leaderboard/", { "week": "1" }).content)
+        self.assertEqual(data["me"], { "rank": 1, "points": awarded })
+        self.assertEqual(data["entries"], [{ "rank": 1, "username": "student", "points": awarded }])
+
+class CompletionLogTests(DeckTestCase):
+    def test_clear_is_logged(self):
+        first, second = Card.objects.filter(user=self.user).order_by("date", "pk")[:2]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "ids": [first.pk, second.pk] }),
+                           content_type="application/json")
+        log = list(CardCompletion.objects.filter(user=self.user).order_by("multiplier"))
+        self.assertEqual([(c.card_id, c.multiplier, c.points) for c in log],
+                         [(first.pk, 1, first.points), (second.pk, 2, second.points * 2)])
+        self.assertEqual((log[0].title, log[0].date, log[0].subject_id), (first.title, first.date, first.subject_id))
+        
+    def test_sync_does_not_restore_cleared_cards(self):
+        card = Card.objects.filter(user=self.user)[0]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "id": str(card.pk) }),
+                           content_type="application/json")
+        self.assertEqual(sync_subject_cards(card.subject, COMMENCE, MIDSEM_BREAK), (0, 0))
+        self.assertEqual(Card.objects.filter(user=self.user).count(), 35)
+        
+    def test_admin_is_read_only(self):
+        card = Card.objects.filter(user=self.user)[0]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "id": str(card.pk) }),
+                           content_type="application/json")
+        completion = CardCompletion.objects.get(user=self.user)
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        self.assertEqual(self.client.get("/admin/main/cardcompletion/add/").status_code, 403)
+        self.assertEqual(self.client.get("/admin/main/cardcompletion/%d/delete/" % completion.pk).status_code, 403)
+        self.client.post("/admin/main/cardcompletion/%d/change/" % completion.pk, { "title": "Edited" })
+        self.assertEqual(CardCompletion.objects.get(pk=completion.pk).title, completion.title)
+
+class StatsTests(DeckTestCase):
+    def assertMatchesRebuild(self):
+        expected = dict((key, counts) for key, counts in stats.rebuild_rows(self.user).items()
+                        if any(counts.values()))
+        self.assertEqual(stats.stored_rows(self.user), expected)
+        
+    def test_rollups_follow_the_deck(self):
+        first, second = Card.objects.filter(user=self.user).order_by("date", "pk")[:2]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "ids": [first.pk, second.pk] }),
+                           content_type="application/json")
+        self.client.post("/studyhero/new-subject/", { "name": "Physics", "colour": "2", "days": ["1"] })
+        self.assertMatchesRebuild()
+        subject = Subject.objects.get(user=self.user, name="Subject 0")
+        subject.days = ["0", "2"]
+        subject.save()
+        sync_subject_cards(subject, COMMENCE, MIDSEM_BREAK)
+        self.assertMatchesRebuild()
+        self.client.post("/studyhero/delete-subject/?name=Physics", { "confirm": "yes" })
+        self.assertMatchesRebuild()
+        create_all_cards(self.user, COMMENCE, MIDSEM_BREAK)
+        self.assertMatchesRebuild()
+        
+    def test_rollups_without_upsert(self):
+        supports_upsert = db.supports_upsert
+        db.supports_upsert = lambda connection: False
+        try:
+            self.test_rollups_follow_the_deck()
+        finally:
+            db.supports_upsert = supports_upsert
+            
+    def test_summary(self):
+        cards = Card.objects.filter(user=self.user).order_by("date", "pk")[:3]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "ids": [card.pk for card in cards] }),
+                           content_type="application/json")
+        data = json.loads(self.client.get("/studyhero/rest/stats/", { "days": 7 }).content)
+        # The whole 2016 semester is in the past
+        self.assertEqual(data["overdue"], 33)
+        self.assertEqual(data["streak"], 1)
+        self.assertEqual([(s["scheduled"], s["completed"]) for s in data["subjects"]], [(36, 3)])
+        self.assertEqual(len(data["days"]), 7)
+        self.assertEqual(data["days"][-1]["cleared"], 3)
+        self.assertEqual(sum(week["points"] for week in data["weeks"]), StudyUser.objects.get(user=self.user).points)
+        
+    def test_migration_backfills_decks_built_before_rollups(self):
+        DailyStats.objects.filter(user=self.user).delete()
+        card = Card.objects.filter(user=self.user).order_by("date", "pk")[0]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "id": str(card.pk) }),
+                           content_type="application/json")
+        import_module("main.migrations.0022_backfill_dailystats").backfill(apps, None)
+        self.assertMatchesRebuild()
+        data = json.loads(self.client.get("/studyhero/rest/stats/").content)
+        self.assertEqual(data["overdue"], 35)
+        self.assertEqual([(s["scheduled"], s["completed"]) for s in data["subjects"]], [(36, 1)])
+        
+    def test_rebuild_replaces_rows(self):
+        DailyStats.objects.filter(user=self.user).update(scheduled=0)
+        stats.rebuild(self.user)
+        self.assertMatchesRebuild()
+        self.assertEqual(sum(DailyStats.objects.filter(user=self.user).values_list("scheduled", flat=True)), 36)
+
+class AgendaTests(DeckTestCase):
+    SUBJECTS = 2
+    DAYS = ["0", "2"]
+    
+    def get(self, **params):
+        params.setdefault("from", COMMENCE.isoformat())
+        return self.client.get("/studyhero/rest/agenda/", params)
+        
+    def test_pages_cover_the_window_once(self):
+        ids, cursor, statements = [], None, set()
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                data = json.loads(self.get(size=10, **({ "cursor": cursor } if cursor else {})).content)
+            statements.add(len(queries))
+            for day in data["days"]:
+                self.assertEqual(day["count"], Card.objects.filter(user=self.user, date=day["date"]).count())
+                ids.extend(card[0] for card in day["cards"])
+            cursor = data["next"]
+            if cursor is None:
+                break
+        expected = list(Card.objects.filter(user=self.user).order_by("date", "pk").values_list("pk", flat=True))
+        self.assertEqual(ids, expected)
+        # Every page costs the same, however far into the semester it is
+        self.assertEqual(len(statements - set([0])), 1)
+        
+    def test_window_and_bad_cursor(self):
+        end = COMMENCE + timedelta(days=6)
+        data = json.loads(self.get(to=end.isoformat()).content)
+        self.assertTrue(all(COMMENCE.isoformat() <= d["date"] <= end.isoformat() for d in data["days"]))
+        self.assertEqual(sum(len(d["cards"]) for d in data["days"]),
+                         Card.objects.filter(user=self.user, date__lte=end).count())
+        self.assertIsNone(data["next"])
+        self.assertEqual(self.get(cursor="nonsense").status_code, 400)
+
+class StudyStateTests(DeckTestCase):
+    def setUp(self):
+        super(StudyStateTests, self).setUp()
+        StudyUser.objects.filter(user=self.user).update(multiplier=5, last_updated=date.today() - timedelta(days=1))
+        
+    def test_cold_get_is_one_query_plus_rollover(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = json.loads(self.client.get("/studyhero/rest/cards/").content)
+        # Session, user, the joined state query and the day's rollover
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(data["multiplier"], 1)
+        self.assertEqual(StudyUser.objects.get(user=self.user).last_updated, date.today())
+        
+    def test_rollover_runs_once_a_day(self):
+        state.load(User.objects.get(pk=self.user.pk))
+        StudyUser.objects.filter(user=self.user).update(multiplier=3)
+        with CaptureQueriesContext(connection) as queries:
+            study_user = state.load(User.objects.get(pk=self.user.pk)).study_user
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(study_user.multiplier, 3)
+        
+    def test_rollover_lost_to_another_request_reloads(self):
+        loaded = state.load(User.objects.get(pk=self.user.pk), date.today() - timedelta(days=1))
+        StudyUser.objects.filter(user=self.user).update(multiplier=3, last_updated=date.today())
+        state.roll_over(loaded, date.today())
+        self.assertEqual((loaded.study_user.multiplier, loaded.study_user.last_updated), (3, date.today()))
+        
+    def test_rollover_after_a_concurrent_clear(self):
+        loaded = state.load(User.objects.get(pk=self.user.pk), date.today() - timedelta(days=1))
+        StudyUser.objects.filter(user=self.user).update(points=F("points") + 10, version=F("version") + 1)
+        state.roll_over(loaded, date.today())
+        study_user = StudyUser.objects.get(user=self.user)
+        self.assertEqual((study_user.multiplier, study_user.version), (1, loaded.study_user.version))
+        self.assertEqual(loaded.study_user.points, study_user.points)
+
+class IndexRenderTests(DeckTestCase):
+    def test_first_deck_is_embedded(self):
+        response = self.client.get("/studyhero/")
+        card = get_next_cards(self.user)[0]
+        self.assertContains(response, '[%d,"%s",' % (card.pk, card.title))
+        self.assertNotContains(response, "var initialDeck = null")
+        
+    def test_subject_fragment_is_cached_until_subjects_change(self):
+        self.client.get("/studyhero/")
+        # Clearing a card changes the deck but not the subject list
+        card = Card.objects.filter(user=self.user).order_by("date", "pk")[0]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "id": str(card.pk) }),
+                           content_type="application/json")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/studyhero/")
+        self.assertFalse([q for q in queries if "main_subject" in q["sql"]])
+        self.client.post("/studyhero/new-subject/", { "name": "Physics", "colour": "2", "days": ["1"] })
+        self.assertContains(self.client.get("/studyhero/"), "Physics (<a")
+        self.client.post("/studyhero/delete-subject/?name=Physics", { "confirm": "yes" })
+        self.assertNotContains(self.client.get("/studyhero/"), "Physics (<a")
+
+class StaticAssetsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = self.settings(STATIC_ROOT=self.directory,
+                                               STATICFILES_STORAGE="main.assets.CompressedManifestStaticFilesStorage")
+        self.settings_override.enable()
+        call_command("collectstatic", interactive=False, verbosity=0)
+        
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+        
+    def test_pages_link_hashed_files_once(self):
+        content = self.client.get("/studyhero/").content
+        self.assertEqual(content.count("css/bootstrap.min."), 1)
+        self.assertRegexpMatches(content, r'/static/js/index\.[0-9a-f]{12}\.js')
+        self.assertNotIn("function showCards", content)
+        
+    def test_hashed_files_are_precompressed_and_immutable(self):
+        url = self.client.get("/studyhero/").content.split('src="')[1].split('"')[0]
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("Accept-Encoding", response["Vary"])
+        plain = self.client.get(url)
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertLess(int(response["Content-Length"]), int(plain["Content-Length"]))
+
+@override_settings(EVENT_STREAMS=True)
+class EventStreamTests(DeckTestCase):
+    def read_event(self, content):
+        chunk = next(content)
+        while chunk.startswith(("retry:", ":")):
+            chunk = next(content)
+        fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        return fields["id"], json.loads(fields["data"])
+        
+    def test_stream_sends_deck_then_changes(self):
+        response = self.client.get("/studyhero/rest/events/")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = iter(response.streaming_content)
+        first_id, deck = self.read_event(content)
+        self.assertEqual(events.hub.count(), 1)
+        
+        # Another tab clears the first card; its commit publishes the change
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "ids": [deck["cards"][0][0]] }),
+                           content_type="application/json")
+        events.publish(self.user.pk)
+        event_id, changed = self.read_event(content)
+        self.assertNotEqual(event_id, first_id)
+        self.assertNotIn(deck["cards"][0][0], [card[0] for card in changed["cards"]])
+        self.assertGreater(changed["points"], deck["points"])
+        response.close()
+        self.assertEqual(events.hub.count(), 0)
+        
+    def test_publish_wakes_only_that_users_streams(self):
+        mine, theirs = events.hub.subscribe(self.user.pk), events.hub.subscribe(self.user.pk + 1)
+        events.publish(self.user.pk)
+        events.publish(self.user.pk)
+        self.assertEqual((mine.wait(0, 0), theirs.wait(0, 0)), (2, 0))
+        mine.close()
+        theirs.close()
+        
+    def test_unread_stream_leaves_no_subscription(self):
+        self.client.get("/studyhero/rest/events/").close()
+        self.client.head("/studyhero/rest/events/")
+        self.assertEqual(events.hub.count(), 0)
+        
+    def test_streams_are_opt_in(self):
+        self.assertIn('data-events="/studyhero/rest/events/"', self.client.get("/studyhero/").content)
+        with self.settings(EVENT_STREAMS=False):
+            self.assertEqual(self.client.get("/studyhero/rest/events/").status_code, 404)
+            self.assertNotIn("data-events", self.client.get("/studyhero/").content)
+
+class SyncTests(DeckTestCase):
+    def sync(self, since=None, clears=None):
+        if clears is None:
+            response = self.client.get("/studyhero/rest/sync/", {} if since is None else { "since": since })
+        else:
+            response = self.client.post("/studyhero/rest/sync/", json.dumps({ "since": since, "clears": clears }),
+                                        content_type="application/json")
+        return json.loads(response.content)
+        
+    def test_deltas_since_a_version(self):
+        full = self.sync()
+        self.assertTrue(full["reset"])
+        self.assertEqual(len(full["cards"]), 36)
+        self.assertEqual(self.sync(full["version"])["cards"], [])
+        
+        first = full["cards"][0][0]
+        self.client.delete("/studyhero/rest/cards/", json.dumps({ "ids": [first] }), content_type="application/json")
+        self.client.post("/studyhero/new-subject/", { "name": "Physics", "colour": "2", "days": ["1"] })
+        delta = self.sync(full["version"])
+        self.assertFalse(delta["reset"])
+        self.assertEqual(delta["deleted"], [first])
+        # The clear's completion is its tombstone
+        self.assertFalse(DeletedCard.objects.filter(user=self.user).exists())
+        self.assertEqual(len(delta["cards"]), 36)
+        self.assertEqual(delta["points"], StudyUser.objects.get(user=self.user).points)
+        
+        self.client.post("/studyhero/delete-subject/?name=Physics", { "confirm": "yes" })
+        self.assertEqual(len(self.sync(delta["version"])["deleted"]), 36)
+        create_all_cards(self.user, COMMENCE, MIDSEM_BREAK)
+        self.assertTrue(self.sync(delta["version"])["reset"])
+        
+    def test_offline_clears_replay_once(self):
+        full = self.sync()
+        clears = [card[0] for card in full["cards"][:2]]
+        once = self.sync(full["version"], clears)
+        twice = self.sync(full["version"], clears)
+        self.assertEqual(once["deleted"], clears)
+        self.assertEqual((twice["points"], twice["multiplier"]), (once["points"], once["multiplier"]))
+        self.assertEqual(CardCompletion.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.client.get("/studyhero/rest/sync/", { "since": "x" }).status_code, 400)
@@ -6,9 +6,18 @@ urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^new-subject/$', views.new_subject, name='new-subject'),
     url(r'^create-cards/$', views.create_cards, name='create-cards'),
+    url(r'^preview-cards/$', views.preview_cards, name='preview-cards'),
     url(r'^delete-subject/$', views.delete_subject, name="delete-subject"),
     url(r'^register/$', views.register, name="register"),
     url(r'^login/$', views.user_login, name="login"),
     url(r'^logout/$', views.user_logout, name="logout"),
     url(r'^rest/cards/$', views.rest_card, name="rest-card"),
+    url(r'^rest/sync/$', views.rest_sync, name="rest-sync"),
+    url(r'^rest/events/$', views.rest_events, name="rest-events"),
+    url(r'^rest/jobs/(?P<job_id>\d+)/$', views.rest_job, name="rest-job"),
+    url(r'^rest/leaderboard/$', views.rest_leaderboard, name="rest-leaderboard"),
+    url(r'^rest/agenda/$', views.rest_agenda, name="rest-agenda"),
+    url(r'^rest/stats/$', views.rest_stats, name="rest-stats"),
+    url(r'^metrics/$', views.metrics_view, name="metrics"),
+    url(r'^profiles/$', views.profiles, name="profiles"),
 ]
@@ -1,20 +1,28 @@
-import json
-from datetime import datetime, timedelta
+import json, pstats
+from datetime import datetime
 
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseNotFound, HttpResponseBadRequest, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseNotModified, FileResponse, StreamingHttpResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.core import serializers
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F
+from django.utils.cache import patch_vary_headers
+from django.utils import timezone
+from django.utils.six import StringIO
+from django.utils.http import parse_etags, quote_etag
 
+from main import agenda, encoding, events, leaderboard, metrics, profiling, state, stats, sync
+from main.caching import deck_etag, get_next_cards_payload, invalidate_deck, invalidate_subjects, \
+    remember_subjects_version, subjects_version
 from main.forms import SubjectForm, UserForm
-from main.models import Subject, Card, StudyUser
-
-ONE_DAY_POINTS = 10
-ONE_WEEK_POINTS = 5
-ONE_MONTH_POINTS = 2
+from main.cards import add_subject_cards
+from main.jobs import enqueue_card_job
+from main.models import Subject, Card, CardCompletion, StudyUser, CardJob
+from main.schedule import Schedule
 
 # Helper methods and classes
 
@@ -36,75 +44,129 @@ def render_success(request, template, success_text, extras=None):
         dict.update(extras)
     return render(request, template, dict)
     
-def add_card(user, title, subject, points, date):
-    return Card.objects.get_or_create(title=title,
-                                      subject=Subject.objects.get(name=subject),
-                                      points=points,
-                                      date=date,
-                                      user=user,
-                                      colour=subject.colour)
+def parse_semester_dates(data):
+    """Reads the commencement and break dates from a request's data.
+    
+    Returns (commence, midsem_break, error_text)."""
+    commence = data.get("commence") or None
+    midsem_break = data.get("break") or None
+    if commence is None or midsem_break is None:
+        return None, None, "Fields missing!"
+    
+    # Parse dates
+    try:
+        commence = datetime.strptime(commence, "%Y-%m-%d").date()
+        midsem_break = datetime.strptime(midsem_break, "%Y-%m-%d").date()
+    except ValueError:
+        return None, None, "Dates must be in the format YYYY-MM-DD!"
+    
+    if not midsem_break > commence:
+        return None, None, "Break date must be after commencement date!"
+    return commence, midsem_break, None
 
-def delete_all_cards(user):
-    Card.objects.filter(user=user).delete()
-                                      
-def create_all_cards(user, commence, midsem_break):
-    for subject in Subject.objects.all().filter(user=user):
-        week_date = commence
-        lecture_number = 1
-        skipped_break = False
-        
-        # 12 weeks of semester
-        for i in range(0, 12):
-            # Time delays for each round of cards
-            time_delays_points = (
-                (timedelta(days=1), ONE_DAY_POINTS),
-                (timedelta(weeks=1), ONE_WEEK_POINTS),
-                (timedelta(weeks=4), ONE_MONTH_POINTS)
-            )
-            # Create the actual card
-            for lecture_day in subject.days:
-                for delay_points in time_delays_points:
-                    add_card(user,
-                             subject.name + " Lecture " + str(lecture_number),
-                             subject.name,
-                             delay_points[1],
-                             week_date + delay_points[0] + timedelta(days=int(lecture_day)))
-                lecture_number += 1
+def get_next_cards(user):
+    """Returns the cards due on the user's earliest due date, or an empty list."""
+    return list(state.due_cards(user))
+
+def clear_cards(user, card_ids):
+    """Deletes the given cards of the user and awards their points, in order.
+    
+    The cards are locked as they are read, so concurrent clears of the same
+    card award it once, and the score is updated in the database rather than
+    read and saved. Every card cleared is logged as a CardCompletion in the
+    same transaction. Returns the ids that were cleared and the user's new
+    (points, multiplier)."""
+    card_ids = [int(card_id) for card_id in card_ids]
+    state.forget(user)
+    with transaction.atomic():
+        # On SQLite the transaction already holds the write lock (see
+        # main.backends.sqlite3), so no other clear can run between the read
+        # and the delete; elsewhere select_for_update locks the rows, the
+        # user's score included
+        cards = dict((row[0], row) for row in Card.objects.select_for_update().filter(pk__in=card_ids, user=user)
+                                                  .values_list("pk", "points", "subject_id", "title", "date",
+                                                               "user__studyuser__points",
+                                                               "user__studyuser__multiplier",
+                                                               "user__studyuser__version"))
+        cleared = []
+        for card_id in card_ids:
+            if card_id in cards and card_id not in cleared:
+                cleared.append(card_id)
                 
-            week_date += timedelta(weeks=1)
+        study_users = StudyUser.objects.filter(user=user)
+        if not cleared:
+            return cleared, study_users.values_list("points", "multiplier").get()
             
-            if week_date >= midsem_break and skipped_break == False:
-                week_date += timedelta(weeks=1)
-                skipped_break = True
-
-def get_next_cards(user):
-    cards = Card.objects.all().filter(user=user).order_by("date")
-    if cards:
-        next_cards = list()
-        first_date = cards[0].date
-        for card in cards:
-            if card.date != first_date:
-                break;
-            next_cards.append(card)
-    return next_cards
+        Card.objects.filter(pk__in=cleared).delete()
+        invalidate_deck(user)
+        # The multiplier goes up by one after each card, so the i-th card
+        # cleared is worth points * (multiplier + i)
+        points, multiplier, version = cards[cleared[0]][5:]
+        base = sum(cards[card_id][1] for card_id in cleared)
+        bonus = sum(i * cards[card_id][1] for i, card_id in enumerate(cleared))
+        study_users.update(points=F("points") + F("multiplier") * base + bonus,
+                           multiplier=F("multiplier") + len(cleared),
+                           version=F("version") + 1)
+        # The score was read under the lock, so the new one follows from it
+        totals = (points + multiplier * base + bonus, multiplier + len(cleared))
+        version += 1
+        sync.remember_version(user, version)
+        
+        # The completions double as the cleared cards' sync tombstones
+        now = timezone.now()
+        completions = []
+        for i, card_id in enumerate(cleared):
+            pk, card_points, subject_id, title, date = cards[card_id][:5]
+            completions.append(CardCompletion(user=user, card_id=pk, subject_id=subject_id, title=title,
+                                              date=date, card_points=card_points, multiplier=multiplier + i,
+                                              points=card_points * (multiplier + i), cleared_at=now,
+                                              version=version))
+        CardCompletion.objects.bulk_create(completions)
+        stats.record_clears(user, completions)
+        leaderboard.add_weekly_points(user, multiplier * base + bonus)
+        return cleared, totals
+        
+def clear_card(user, card_id):
+    """Clears a single card; returns the new (points, multiplier), or None if
+    there was no such card."""
+    cleared, totals = clear_cards(user, [card_id])
+    if not cleared:
+        return None
+    return totals
+    
+def next_cards_data(user):
+    """Returns the next-cards payload, from the cache if the deck is unchanged."""
+    return get_next_cards_payload(user, build_next_cards_data)[0]
+    
+def build_next_cards_data(user):
+    """Builds the next-cards payload: the cards due next, the time left to do
+    them and the user's score."""
+    today = datetime.now().date()
+    study_user, cards = state.load(user, today)
+    return encoding.deck(cards, study_user, today)
 
-def check_multiplier(user, card):
-    study_user = StudyUser.objects.get(user=user)
-    now = datetime.now().date()
-    if study_user.last_updated != now:
-        study_user.last_updated = now
-        if now > card.date:
-            study_user.multiplier = 1
-        study_user.save()
 # Views
     
 @ensure_csrf_cookie
-def index(request, message=None):
+def index(request, message=None, job=None, subjects=None):
     dict = { }
     if request.user.is_authenticated():
-        dict = { "subjects": Subject.objects.all().filter(user=request.user) }
+        # The subject list is a cached fragment, so the query only runs on a
+        # miss, unless the caller has already read the subjects
+        if subjects is None:
+            subjects = Subject.objects.all().filter(user=request.user)
+        dict = { "subjects": subjects,
+                 "subjects_version": subjects_version(request.user),
+                 "event_streams": events.enabled() }
+        # Embed the first deck in the page rather than fetching it after load
+        try:
+            dict["deck"] = encoding.script_json(next_cards_data(request.user))
+        except ObjectDoesNotExist:
+            pass
     if message is not None:
         dict.update({ "message": message })
+    if job is not None:
+        dict.update({ "job": job })
         
     return render(request, "index.html", dict)
     
@@ -118,7 +180,6 @@ def new_subject(request):
             # Check uniqueness conditions
             user_subjects = Subject.objects.all().filter(user=subject.user)
             valid = True
-            print subject.colour
             if len(user_subjects.filter(name=subject.name)) != 0:
                 valid = False;
                 form.add_error("name", "Name is already in use.")
@@ -127,8 +188,14 @@ def new_subject(request):
                 form.add_error("colour", "Colour is already in use.")
                 
             if valid:
-                subject.save()                
-                return index(request, PageMessage(text="Successfully created subject!", colour="Green"))
+                subject.save()
+                # Only the new subject's cards are written; the rest of the deck stays
+                added = add_subject_cards(subject)
+                invalidate_subjects(request.user)
+                text = "Successfully created subject!"
+                if added:
+                    text = "Successfully created subject and its " + str(added) + " cards!"
+                return index(request, PageMessage(text=text, colour="Green"))
     else:
         form = SubjectForm()
     return render(request, "new-subject.html", { 'form': form })
@@ -136,25 +203,41 @@ def new_subject(request):
 @login_required
 def create_cards(request):
     if request.method == "POST":
-        commence = request.POST["commence"] or None
-        midsem_break = request.POST["break"] or None
-        if commence is None or midsem_break is None:
-            return render_error(request, "create-cards.html", "Fields missing!")
-        
-        # Parse dates
-        commence = datetime.strptime(commence, "%Y-%m-%d")
-        midsem_break = datetime.strptime(midsem_break, "%Y-%m-%d")
+        commence, midsem_break, error = parse_semester_dates(request.POST)
+        if error is not None:
+            return render_error(request, "create-cards.html", error)
         
-        if not midsem_break > commence:
-            return render_error(request, "create-cards.html", "Break date must be after commencement date!")
-        
-        # Perform database manipulation
-        delete_all_cards(request.user)
-        create_all_cards(request.user, commence, midsem_break)
-        return index(request, PageMessage(text="Successfully created cards!", colour="Green"))
+        # The cards are made by a background worker; poll rest-job for progress
+        job = enqueue_card_job(request.user, commence, midsem_break)
+        if request.is_ajax():
+            return HttpResponse(json.dumps(job_data(job)), content_type="application/json")
+        return index(request, PageMessage(text="Creating your cards...", colour="Green"), job=job)
         
     return render(request, "create-cards.html")
     
+@login_required
+def preview_cards(request):
+    """Shows what create_cards would produce, without changing the deck."""
+    commence, midsem_break, error = parse_semester_dates(request.GET)
+    if error is not None:
+        return HttpResponseBadRequest(error)
+    
+    subjects = list(Subject.objects.filter(user=request.user))
+    schedule = Schedule(commence, midsem_break)
+    missing, extra = schedule.diff(subjects, Card.objects.filter(user=request.user))
+    planned = schedule.cards(subjects)
+    data = {
+        "count": len(planned),
+        "added": len(missing),
+        "removed": len(extra),
+        "cards": [{ "title": card.title,
+                    "subject": card.subject.name,
+                    "colour": card.subject.get_colour_display(),
+                    "points": card.points,
+                    "date": card.date.isoformat() } for card in planned],
+    }
+    return HttpResponse(json.dumps(data), content_type="application/json")
+    
 @login_required
 def delete_subject(request):
     subject = request.GET.get("name") or None
@@ -162,8 +245,30 @@ def delete_subject(request):
         if request.method == "POST":
             delete = request.POST["confirm"] or None
             if not delete is None and delete == "yes":
-                print Card.objects.filter(subject=Subject.objects.get(name=subject).pk).delete()
-                Subject.objects.get(name=subject).delete()
+                with transaction.atomic():
+                    # One read serves the delete and the subject list shown after it
+                    subjects = list(Subject.objects.filter(user=request.user))
+                    deleted = [s for s in subjects if s.name == subject]
+                    subjects = [s for s in subjects if s.name != subject]
+                    if deleted:
+                        stats.remove_subject(request.user, [s.pk for s in deleted])
+                        cards = list(Card.objects.select_for_update().filter(subject__in=deleted)
+                                                 .values_list("pk", "user__studyuser__version",
+                                                              "user__studyuser__subjects_version"))
+                        current, current_subjects = cards[0][1:] if cards else (None, None)
+                        # One statement raises the deck's and the subject list's versions
+                        version = sync.next_version(request.user, current,
+                                                    subjects_version=F("subjects_version") + 1)
+                        remember_subjects_version(request.user,
+                                                  None if current_subjects is None else current_subjects + 1)
+                        sync.record_deleted(request.user, [row[0] for row in cards], version)
+                        # Nothing refers to a card, so the cascade deletes
+                        # them in one statement rather than row by row
+                        for s in deleted:
+                            s.delete()
+                        invalidate_deck(request.user)
+                return index(request, PageMessage(text="Successfully deleted " + subject + "!", colour="Green"),
+                             subjects=subjects)
         else:                
             return render(request, "delete-subject.html", { "subject": subject })
     return index(request, PageMessage(text="Successfully deleted " + subject + "!", colour="Green"));
@@ -219,42 +324,196 @@ def user_logout(request):
 # RESTful API views
     
 def rest_clear_card(request):
-    data = json.loads(request.body) or None
-    if data is None:
+    try:
+        data = json.loads(request.body) or None
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
         return HttpResponseBadRequest()
+        
+    if "ids" in data:
+        # Batch clear: reply with the refreshed deck so no GET is needed
+        if not isinstance(data["ids"], list):
+            return HttpResponseBadRequest()
+        try:
+            cleared = clear_cards(request.user, data["ids"])[0]
+            deck = dict(next_cards_data(request.user), cleared=cleared)
+        except (ValueError, TypeError, ObjectDoesNotExist):
+            return HttpResponseBadRequest()
+        return HttpResponse(encoding.encode(deck), content_type=encoding.JSON_TYPE)
+        
     try:
-        id = data.get("id")
-        card = Card.objects.get(pk=id, user=request.user) or None
-        user = StudyUser.objects.get(user=request.user)
-        user.points += card.points * user.multiplier
-        user.multiplier += 1
-        user.save()
-        card.delete()
-    except:
+        result = clear_card(request.user, data.get("id"))
+    except (ValueError, TypeError, ObjectDoesNotExist):
+        result = None
+    if result is None:
         return HttpResponseNotFound()
         
-    return HttpResponse()
+    points, multiplier = result
+    return HttpResponse(json.dumps({ "points": points, "multiplier": multiplier }),
+                        content_type="application/json")
+    
+def rest_sync(request):
+    """The changes to the user's deck and score since ?since= (or "since" in
+    a POST), after replaying the POST's "clears", a list of card ids cleared
+    offline. Clears of cards already gone are skipped, so a retried POST
+    changes nothing."""
+    if not request.user.is_authenticated():
+        return HttpResponseNotFound()
+    try:
+        if request.method == "POST":
+            data = json.loads(request.body)
+            if not isinstance(data, dict) or not isinstance(data.get("clears", []), list):
+                return HttpResponseBadRequest()
+            since = data.get("since")
+            since = int(since) if since is not None else None
+            clear_cards(request.user, data.get("clears", []))
+        else:
+            since = request.GET.get("since")
+            since = int(since) if since is not None else None
+        data = sync.changes(request.user, since)
+    except (ValueError, TypeError, ObjectDoesNotExist):
+        return HttpResponseBadRequest()
+    return HttpResponse(encoding.encode(data), content_type=encoding.JSON_TYPE)
     
 def rest_get_cards(request):
+    content_type = encoding.negotiate(request.META.get("HTTP_ACCEPT"))
+    
+    # Answer a poll for an unchanged deck without building the payload
+    etag = deck_etag(request.user) + ("-msgpack" if content_type == encoding.MSGPACK_TYPE else "")
+    if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        response = HttpResponseNotModified()
+        response["ETag"] = quote_etag(etag)
+        return response
+        
     try:
-        cards = get_next_cards(request.user)
-        check_multiplier(request.user, cards[0])
+        data, hit = get_next_cards_payload(request.user, build_next_cards_data)
     except ObjectDoesNotExist:
         return HttpResponseNotFound()
-                
-    time_distance = (cards[0].date - datetime.now().date()).days
-    data = serializers.serialize('json', cards)
-    # unfortunately Django doesn't make this as nice as it could be
-    # here I just encode the time left to do the card in the JSON string
-    # before returning it
-    study_user = StudyUser.objects.get(user=request.user)
-    final_data = "[{"
-    final_data += '"time_distance": ' + str(time_distance) + ", "
-    final_data += '"points": ' + str(study_user.points) + ", "
-    final_data += '"multiplier": ' + str(study_user.multiplier) + ", "
-    final_data += data[2:]
-    print data
-    return HttpResponse(final_data)
+    response = HttpResponse(encoding.encode(data, content_type), content_type=content_type)
+    response["X-Cache"] = "hit" if hit else "miss"
+    response["ETag"] = quote_etag(etag)
+    # Clients must revalidate, which is a 304 until the deck changes
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ("Accept",))
+    return response
+    
+def rest_events(request):
+    """A server-sent event stream of the user's deck, sent again whenever it
+    changes; the data is the rest-card GET payload. Off unless EVENT_STREAMS
+    is set (see main.events)."""
+    if not request.user.is_authenticated() or not events.enabled():
+        return HttpResponseNotFound()
+    user = request.user
+    
+    def render():
+        # The stream outlives the request, so never reuse its loaded state
+        state.forget(user)
+        return deck_etag(user), encoding.encode(next_cards_data(user))
+        
+    response = StreamingHttpResponse(events.stream(events.hub, user.pk, render,
+                                                   request.META.get("HTTP_LAST_EVENT_ID")),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop proxies such as nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+    
+def job_data(job):
+    return {
+        "id": job.pk,
+        "status": job.status,
+        "progress": job.progress,
+        "cards": job.cards,
+    }
+    
+def rest_job(request, job_id):
+    if not request.user.is_authenticated():
+        return HttpResponseNotFound()
+    try:
+        job = CardJob.objects.get(pk=job_id, user=request.user)
+    except ObjectDoesNotExist:
+        return HttpResponseNotFound()
+    return HttpResponse(json.dumps(job_data(job)), content_type="application/json")
+    
+def rest_leaderboard(request):
+    """A page of the overall or this week's leaderboard, and the user's rank;
+    pass the returned "next" as ?cursor= for the next page."""
+    if not request.user.is_authenticated():
+        return HttpResponseNotFound()
+    week = leaderboard.week_start() if request.GET.get("week") and leaderboard.weekly_enabled() else None
+    try:
+        size = min(100, max(1, int(request.GET.get("size", 20))))
+        entries, cursor = leaderboard.top(week, request.GET.get("cursor") or None, size)
+    except ValueError:
+        return HttpResponseBadRequest()
+        
+    me = leaderboard.rank(request.user, week)
+    data = {
+        "week": week.isoformat() if week else None,
+        "entries": [{ "rank": rank, "username": username, "points": points }
+                    for rank, username, points in entries],
+        "next": cursor,
+        "me": { "rank": me[0], "points": me[1] } if me else None,
+    }
+    return HttpResponse(json.dumps(data), content_type="application/json")
+    
+def rest_agenda(request):
+    """A page of the user's cards due between ?from= (default today) and ?to=,
+    grouped by day; pass the returned "next" as ?cursor= for the next page."""
+    if not request.user.is_authenticated():
+        return HttpResponseNotFound()
+    try:
+        start = request.GET.get("from")
+        start = datetime.strptime(start, "%Y-%m-%d").date() if start else datetime.now().date()
+        end = request.GET.get("to")
+        end = datetime.strptime(end, "%Y-%m-%d").date() if end else None
+        size = min(200, max(1, int(request.GET.get("size", 50))))
+        data = agenda.page(request.user, start, end, request.GET.get("cursor") or None, size)
+    except ValueError:
+        return HttpResponseBadRequest()
+    return HttpResponse(json.dumps(data), content_type="application/json")
+    
+def rest_stats(request):
+    """Streak, per-subject completion, overdue cards and recent points, for charts."""
+    if not request.user.is_authenticated():
+        return HttpResponseNotFound()
+    try:
+        days = min(365, max(1, int(request.GET.get("days", 28))))
+    except ValueError:
+        return HttpResponseBadRequest()
+    data = stats.summary(request.user, days)
+    return HttpResponse(json.dumps(data), content_type="application/json")
+    
+@staff_member_required
+def metrics_view(request):
+    """Request histograms for each view, in the Prometheus text format."""
+    return HttpResponse(metrics.registry.render(), content_type="text/plain; version=0.0.4")
+    
+@staff_member_required
+def profiles(request):
+    """Lists saved profiles and shows or downloads one of them."""
+    directory = profiling.config()["DIRECTORY"]
+    name = request.GET.get("name")
+    report = None
+    if name is not None:
+        path = profiling.profile_path(name)
+        if path is None:
+            return HttpResponseNotFound()
+        if request.GET.get("download"):
+            response = FileResponse(open(path, "rb"), content_type="application/octet-stream")
+            response["Content-Disposition"] = 'attachment; filename="%s"' % name
+            return response
+        if name.endswith(".prof"):
+            stream = StringIO()
+            pstats.Stats(path, stream=stream).sort_stats("cumulative").print_stats(60)
+            report = stream.getvalue()
+        else:
+            with open(path) as folded:
+                report = folded.read()
+    return render(request, "profiles.html", { "profiles": profiling.list_profiles(directory),
+                                              "name": name,
+                                              "report": report })
     
 REST_CARD_ACTIONS = {
     "GET": rest_get_cards,
@@ -0,0 +1,123 @@
+function getCookie(name) {
+    var cookieValue = null;
+    if (document.cookie && document.cookie !== '') {
+        var cookies = document.cookie.split(';');
+        for (var i = 0; i < cookies.length; ++i) {
+            var cookie = jQuery.trim(cookies[i]);
+            if (cookie.substring(0, name.length + 1) === (name + '=')) {
+                cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+                break;
+            }
+        }
+    }
+    return cookieValue;
+}
+var csrftoken = getCookie("csrftoken");
+function csrfSafeMethod(method) {
+    // these HTTP methods do not require CSRF protection
+    return (/^(GET|HEAD|OPTIONS|TRACE)$/.test(method));
+}
+$.ajaxSetup({
+    beforeSend: function(xhr, settings) {
+        if (!csrfSafeMethod(settings.type) && !this.crossDomain) {
+            xhr.setRequestHeader("X-CSRFToken", csrftoken);
+        }
+    }
+});
+
+function showCards(deck) {
+    var cardList = $('#cardlist');
+    cardList.empty();
+    // Each card is a row of [id, title, subject, colour, points]
+    for (var i = 0; i < deck.cards.length; ++i) {
+        var row = deck.cards[i];
+        cardList.append(buildCard(row[0], { title: row[1], colour: row[3], points: row[4] }, deck.time_distance));
+    }
+    var heading = "Next card";
+    if (deck.cards.length != 1) {
+        heading += "s";
+    }
+    $('#cardheader').html(heading);
+    $('#heading').html(deck.points + " points | " + deck.multiplier + "x");
+}
+
+function updateCards() {
+    $.getJSON("/studyhero/rest/cards/", { }, function(data, jqXHR) {
+        showCards(data);
+    });
+}
+
+// How often pages without an event stream check for a changed deck
+var POLL_MS = 60000;
+
+var COLOURS = {
+    "Red":      "danger",
+    "Yellow":   "warning",
+    "Green":    "success",
+    "Blue":     "info",
+};
+
+function buildCard(pk, card, timeDistance) {
+    tag = '<div class="panel panel-' + COLOURS[card.colour] + '"><div class="panel-heading">' + card.title + '</div><div class="panel-body"><h4>' + card.points + ' points</h4>';
+    tag += (timeDistance > 0) ? ('Due in ' + timeDistance) : ('Overdue by ' + (-timeDistance));
+    tag +=  ' day';
+    tag += (timeDistance == 1 || timeDistance == -1)?(''):('s');
+    tag += '<br /><br /><button onclick="clearCard(' + pk + ');">Done</button></div></div>';
+    return tag;
+}
+
+function clearCard(id) {
+    // The response carries the refreshed deck, so there is no second request
+    $.ajax({
+        type:           "DELETE",
+        url:            "/studyhero/rest/cards/",
+        data:           JSON.stringify({ "ids": [id] }),
+        contentType:    "application/json",
+        dataType:       "json",
+        success:        showCards,
+    });
+}
+
+function waitForJob(url) {
+    $.getJSON(url, { }, function(job) {
+        if (job.status == "done") {
+            $('#jobstatus').html("Created " + job.cards + " cards!");
+            updateCards();
+        } else if (job.status == "failed") {
+            $('#jobstatus').html("Sorry, your cards could not be created.");
+        } else {
+            $('#jobstatus').html("Creating your cards... " + job.progress + "%");
+            setTimeout(function() { waitForJob(url); }, 500);
+        }
+    });
+}
+
+window.onload = function() {
+    // The first deck comes with the page as JSON; later ones are fetched
+    var initialDeck = $('#initial-deck');
+    if (initialDeck.length) {
+        showCards(JSON.parse(initialDeck.text()));
+    } else {
+        updateCards();
+    }
+    var jobStatus = $('#jobstatus');
+    if (jobStatus.length) {
+        waitForJob(jobStatus.data("url"));
+    }
+    // Changes made in other tabs and devices are pushed to this one where
+    // the server streams them, and polled for otherwise
+    var eventsUrl = $('#cardlist').data("events");
+    if (eventsUrl && window.EventSource) {
+        var events = new EventSource(eventsUrl);
+        events.addEventListener("deck", function(event) {
+            showCards(JSON.parse(event.data));
+        });
+    } else {
+        // The deck revalidates its ETag, so a poll is a 304 until it changes
+        setInterval(function() {
+            if (!document.hidden) {
+                updateCards();
+            }
+        }, POLL_MS);
+    }
+};
@@ -37,10 +37,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'main',
+    'main.apps.MainConfig',
 ]
 
 MIDDLEWARE_CLASSES = [
+    'main.middleware.RequestMetricsMiddleware',
+    'main.middleware.ProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,12 +55,22 @@ MIDDLEWARE_CLASSES = [
 
 ROOT_URLCONF = 'studyhero.urls'
 
+AUTHENTICATION_BACKENDS = [
+    # ModelBackend, loading each request's StudyUser along with its user
+    'main.auth.StudyUserBackend',
+    # Still resolves sessions logged in before StudyUserBackend existed
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'main.backends.templates.DjangoTemplates',
         'DIRS': ['./templates/'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -69,6 +81,11 @@ TEMPLATES = [
     },
 ]
 
+if not DEBUG:
+    # Compile each template once per process rather than on every render
+    TEMPLATES[0]['OPTIONS']['loaders'] = [('django.template.loaders.cached.Loader',
+                                           TEMPLATES[0]['OPTIONS']['loaders'])]
+
 WSGI_APPLICATION = 'studyhero.wsgi.application'
 
 
@@ -77,8 +94,28 @@ WSGI_APPLICATION = 'studyhero.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # The stock sqlite3 backend with statement timing for main.metrics
+        'ENGINE': 'main.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Keep connections open across requests rather than reconnecting
+        'CONN_MAX_AGE': 600,
+    }
+}
+
+# Every new SQLite connection runs main.db.DEFAULT_SQLITE_PRAGMAS; set
+# SQLITE_PRAGMAS here to override them. Benchmark with manage.py bench_sqlite.
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# Holds the per-user next-cards payload and page fragments, keyed on the
+# version stored with each user, so processes with their own local memory
+# never serve each other's stale entries; a shared backend only saves rebuilds.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'studyhero',
     }
 }
 
@@ -119,8 +156,35 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
-STATIC_ROOT = ""
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATIC_URL = '/static/'
 STATICFILES_DIRS = ( os.path.join('static'), )
-
-LOGIN_URL = "/studyhero/login/"
\ No newline at end of file
+if not DEBUG:
+    # Hashed, precompressed files from collectstatic (see main.assets)
+    STATICFILES_STORAGE = 'main.assets.CompressedManifestStaticFilesStorage'
+
+LOGIN_URL = "/studyhero/login/"
+
+# Where create-cards jobs run (see main.jobs): "thread" for a worker thread in
+# each web process, or None to leave them to `manage.py run_card_jobs`.
+CARD_JOBS_WORKER = 'thread'
+
+# Keep a per-week leaderboard alongside the overall one (see main.leaderboard)
+LEADERBOARD_WEEKLY = True
+
+# Push deck changes to open pages over server-sent events (see main.events).
+# Each open page holds a server thread, and a change reaches only the streams
+# of the process that made it, so only turn this on for a single process of a
+# threaded server; otherwise pages poll.
+EVENT_STREAMS = False
+
+# Request profiling (see main.profiling); saved profiles are listed at
+# /studyhero/profiles/ for staff.
+PROFILER = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,
+    'SLOW_THRESHOLD_MS': 1000,
+    'MAX_PER_MINUTE': 10,
+    'KEEP': 100,
+    'DIRECTORY': os.path.join(BASE_DIR, 'profiles'),
+}
\ No newline at end of file
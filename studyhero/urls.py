@@ -13,10 +13,17 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.conf.urls import url, include
 from django.contrib import admin
 
+from main import assets
+
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^studyhero/', include('main.urls')),
 ]
+
+if not settings.DEBUG:
+    # Collected files; runserver serves the originals itself in DEBUG
+    urlpatterns.append(url(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), assets.serve))